@@ -1,18 +1,34 @@
 from flask import Flask, request
-from PIL import Image
-import io
 from models import MODELS
 from logger import logger
-from models.registry import get_model_handler
+from models.registry import Rejected, get_model_handler, preload_models
 from models.cups import cups_ai
+from models.calibration import parse_points
+from models.memory_server import calibration
+from dispatch import run_action, run_action_batch
+from workers import get_worker
+from imaging import decode_image, split_frames
+from sessions import request_session
+import config
+import metrics
+import multiprocessing
 import threading
 import logging
+import time
 import os
 
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 app = Flask(__name__)
 
+# Actions served by worker processes load their weights there instead, and the
+# workers themselves (which re-import this module when spawned) skip this step
+if multiprocessing.parent_process() is None:
+    preload_models(
+        name for name in config.PRELOAD_MODELS
+        if name not in MODELS or get_worker(name) is None
+    )
+
 
 @app.route("/cups/start", methods=["POST"])
 def start_cups():
@@ -44,30 +60,125 @@ def process_image():
         logger.error(f"No model found for action: '{action_name}'")
         return "error", 400
 
+    start = time.perf_counter()
+    metrics.inc("requests", action=action_name)
+
     try:
 
-        if "image" in request.files:
-            img = Image.open(request.files["image"].stream).convert("RGB")
-            logger.info("Image successfully loaded from 'files'.")
-        else:
-            img = Image.open(io.BytesIO(request.get_data())).convert("RGB")
-            logger.info("Image successfully loaded from raw data.")
+        scale = config.DECODE_SCALES.get(action_name, 1)
+        with metrics.timed(action_name, "decode"):
+            if "image" in request.files:
+                img = decode_image(request.files["image"].stream, scale)
+                logger.info("Image successfully loaded from 'files'.")
+            else:
+                img = decode_image(request.get_data(), scale)
+                logger.info("Image successfully loaded from raw data.")
 
         
     except Exception as e:
         logger.error(f"Failed to open image: {e}")
+        metrics.inc("errors", action=action_name)
         return "error", 400
 
     try:
-        result = handler(img)
+        result = run_action(action_name, img, request_session(request))
         logger.info(f"Successfully processed image with action: '{action_name}'")
+    except Rejected as e:
+        logger.warning(f"Rejected frame for action '{action_name}': {e}")
+        metrics.inc("rejected_frames", action=action_name)
+        return f"rejected: {e}", e.status
+    except TimeoutError as e:
+        logger.error(str(e))
+        metrics.inc("errors", action=action_name)
+        return "busy", 503
     except Exception as e:
         logger.error(f"Failed to process image with action '{action_name}': {e}")
+        metrics.inc("errors", action=action_name)
         return f"error", 500
 
+    metrics.observe(action_name, "total", time.perf_counter() - start)
     return result, 200
 
 
+@app.route("/process/batch", methods=["POST"])
+def process_batch():
+    client_ip = request.remote_addr
+    logger.info(f"Batch request from IP: {client_ip}")
+
+    action_name = request.args.get("action")
+
+    if not action_name or action_name not in MODELS:
+        logger.error(f"Invalid action specified: '{action_name}'")
+        return "error", 400
+
+    start = time.perf_counter()
+    metrics.inc("requests", action=action_name)
+
+    try:
+        scale = config.DECODE_SCALES.get(action_name, 1)
+        with metrics.timed(action_name, "decode"):
+            if "image" in request.files:
+                imgs = [decode_image(f.stream, scale) for f in request.files.getlist("image")]
+            else:
+                imgs = [decode_image(frame, scale) for frame in split_frames(request.get_data())]
+    except Exception as e:
+        logger.error(f"Failed to open batch images: {e}")
+        metrics.inc("errors", action=action_name)
+        return "error", 400
+
+    if not imgs:
+        logger.error("No images in batch request.")
+        metrics.inc("errors", action=action_name)
+        return "error", 400
+
+    logger.info(f"Received batch of {len(imgs)} images for action: '{action_name}'")
+
+    try:
+        results = run_action_batch(action_name, imgs, request_session(request))
+    except Rejected as e:
+        logger.warning(f"Rejected frame for action '{action_name}': {e}")
+        metrics.inc("rejected_frames", action=action_name)
+        return f"rejected: {e}", e.status
+    except TimeoutError as e:
+        logger.error(str(e))
+        metrics.inc("errors", action=action_name)
+        return "busy", 503
+    except Exception as e:
+        logger.error(f"Failed to process batch with action '{action_name}': {e}")
+        metrics.inc("errors", action=action_name)
+        return "error", 500
+
+    metrics.observe(action_name, "total", time.perf_counter() - start)
+    # One result per line, in the same order as the uploaded images
+    return "\n".join(results), 200
+
+
+@app.route("/calibrate", methods=["GET", "POST"])
+def calibrate():
+    """Read or replace the memory game's grid corners (coords.txt)"""
+    if request.method == "GET":
+        points = calibration.points or []
+        return "\n".join(f"{x},{y}" for x, y in points), 200
+
+    try:
+        if request.is_json:
+            points = request.get_json()["points"]
+        else:
+            points = parse_points(request.get_data(as_text=True))
+        calibration.update(points)
+    except Exception as e:
+        logger.error(f"Invalid calibration: {e}")
+        return "error", 400
+
+    logger.info(f"Grid calibration updated: {calibration.points}")
+    return "1", 200
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
 if __name__ == "__main__":
     print("Starting Flask server...", flush=True)
     app.run(host="0.0.0.0", port=8000, debug=False)
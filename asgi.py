@@ -0,0 +1,191 @@
+"""ASGI entry point: `uvicorn asgi:app --host 0.0.0.0 --port 8000`
+
+`/process` and `/process/batch` are served natively: the body is read and the
+image decoded on the event loop, and the model runs on the action's bounded
+worker pool (see pools.py), answering 503 when that pool is full. Every other
+route is forwarded to the Flask app in app.py.
+"""
+
+import asyncio
+import io
+import sys
+import time
+
+from werkzeug.wrappers import Request
+
+from app import app as flask_app
+import config
+import metrics
+from dispatch import run_action, run_action_batch
+from imaging import decode_image, split_frames
+from logger import logger
+from models import MODELS
+from models.registry import Rejected
+from pools import Overloaded, get_pool
+from sessions import request_session
+
+
+def build_environ(scope, body: bytes) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client")
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0] if client else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        # The whole body is already buffered, so it can be read without a Content-Length
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1")
+        value = value.decode("latin1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_flask(environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = headers
+
+    chunks = flask_app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return response["status"], response["headers"], body
+
+
+async def read_body(receive) -> bytes:
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return bytes(body)
+
+
+async def send_response(send, status: int, body, headers):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    raw_headers = [
+        (k.lower().encode("latin1"), v.encode("latin1"))
+        for k, v in headers
+        if k.lower() != "content-length"
+    ]
+    raw_headers.append((b"content-length", str(len(body)).encode("latin1")))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def process(request: Request, batch: bool):
+    action_name = request.args.get("action")
+    logger.info(f"Request from IP: {request.remote_addr}")
+
+    if not action_name or action_name not in MODELS:
+        logger.error(f"Invalid action specified: '{action_name}'")
+        return "error", 400
+
+    start = time.perf_counter()
+    metrics.inc("requests", action=action_name)
+
+    # Decoding stays on the event loop; only the model call goes to the pool
+    try:
+        scale = config.DECODE_SCALES.get(action_name, 1)
+        with metrics.timed(action_name, "decode"):
+            if "image" in request.files:
+                imgs = [decode_image(f.stream, scale) for f in request.files.getlist("image")]
+            elif batch:
+                imgs = [decode_image(frame, scale) for frame in split_frames(request.get_data())]
+            else:
+                imgs = [decode_image(request.get_data(), scale)]
+    except Exception as e:
+        logger.error(f"Failed to open image: {e}")
+        metrics.inc("errors", action=action_name)
+        return "error", 400
+
+    if not imgs:
+        logger.error("No images in request.")
+        metrics.inc("errors", action=action_name)
+        return "error", 400
+
+    session = request_session(request)
+    try:
+        if batch:
+            future = get_pool(action_name).submit(run_action_batch, action_name, imgs, session)
+        else:
+            future = get_pool(action_name).submit(run_action, action_name, imgs[0], session)
+    except Overloaded as e:
+        logger.warning(str(e))
+        metrics.inc("rejected", action=action_name)
+        return "busy", 503
+
+    try:
+        result = await asyncio.wrap_future(future)
+        logger.info(f"Successfully processed image with action: '{action_name}'")
+    except Rejected as e:
+        logger.warning(f"Rejected frame for action '{action_name}': {e}")
+        metrics.inc("rejected_frames", action=action_name)
+        return f"rejected: {e}", e.status
+    except TimeoutError as e:
+        logger.error(str(e))
+        metrics.inc("errors", action=action_name)
+        return "busy", 503
+    except Exception as e:
+        logger.error(f"Failed to process image with action '{action_name}': {e}")
+        metrics.inc("errors", action=action_name)
+        return "error", 500
+
+    metrics.observe(action_name, "total", time.perf_counter() - start)
+    return ("\n".join(result) if batch else result), 200
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    environ = build_environ(scope, body)
+
+    if scope["method"] == "POST" and scope["path"] in ("/process", "/process/batch"):
+        result, status = await process(Request(environ), scope["path"] == "/process/batch")
+        headers = [("Retry-After", "1")] if status == 503 else []
+        await send_response(send, status, result, [("Content-Type", "text/html; charset=utf-8")] + headers)
+        return
+
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(None, call_flask, environ)
+    await send_response(send, status, body, headers)
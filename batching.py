@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from typing import Callable, List
+
+from errors import Rejected
+from logger import logger
+
+
+class MicroBatcher:
+    """Collects concurrent requests for one action and runs them as a single batch.
+
+    The first queued item opens a window of `window` seconds; everything that
+    arrives before it closes (up to `max_batch_size` items) is passed to `fn`
+    in one call and the results are handed back to the waiting callers.
+    Callers give up after `timeout` seconds with a `TimeoutError`.
+
+    A batch that raises `Rejected` (e.g. one client's session was refused) is
+    run again one item at a time, so only the offending items are rejected;
+    handlers raise it before changing any state.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[List], List],
+        max_batch_size: int,
+        window: float,
+        timeout: float = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Not run at all if it is still queued
+            future.cancel()
+            raise TimeoutError(f"Action '{self.name}' did not answer within {self.timeout}s")
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Callers that timed out while queued have cancelled their futures
+            batch = [(item, future) for item, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.fn(items))
+            except Rejected as e:
+                if len(batch) > 1:
+                    self._run_each(batch)
+                else:
+                    batch[0][1].set_exception(e)
+                continue
+            except BaseException as e:
+                # Anything the handler raises fails this batch, never the thread
+                logger.error(f"Batch of {len(items)} failed for action '{self.name}': {e!r}")
+                if not isinstance(e, Exception):
+                    e = RuntimeError(f"Batch failed: {e!r}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            if len(results) != len(batch):
+                logger.error(f"Action '{self.name}' returned {len(results)} results for a batch of {len(batch)}")
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            for _, future in batch[len(results) :]:
+                future.set_exception(RuntimeError(f"Action '{self.name}' returned no result for this item"))
+
+    def _run_each(self, batch):
+        for item, future in batch:
+            try:
+                results = list(self.fn([item]))
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    e = RuntimeError(f"Batch failed: {e!r}")
+                future.set_exception(e)
+                continue
+            if results:
+                future.set_result(results[0])
+            else:
+                future.set_exception(RuntimeError(f"Action '{self.name}' returned no result for this item"))
@@ -0,0 +1,115 @@
+"""Micro-benchmark card-to-cell assignment in the memory detector.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_memory_assign
+
+Compares `place_cards` against the per-box loop it replaced on synthetic
+detections, and checks both place the same card in every cell.
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from models.memory_server import COLS, ROWS, create_grid_matrix, place_cards
+
+FRAME_SIZE = (720, 1280)
+GRID_POINTS = [(200, 120), (1080, 140), (1060, 620), (220, 600)]
+NAMES = {i: f"card{i}" for i in range(12)}
+
+
+class Boxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy = xyxy
+        self.cls = cls
+        self.conf = conf
+
+    def __len__(self):
+        return len(self.cls)
+
+
+class Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.names = NAMES
+
+
+def synthetic_result(rng, count: int) -> Result:
+    h, w = FRAME_SIZE
+    centers = rng.uniform((0, 0), (w, h), size=(count, 2))
+    sizes = rng.uniform(40, 120, size=(count, 2))
+    xyxy = np.hstack([centers - sizes / 2, centers + sizes / 2]).astype(np.float32)
+    cls = rng.integers(0, len(NAMES), size=count).astype(np.float32)
+    conf = rng.uniform(0.3, 1.0, size=count).astype(np.float32)
+    return Result(Boxes(xyxy, cls, conf))
+
+
+def place_cards_loop(r, M, grid_size, offset=(0, 0)):
+    """The per-box implementation `place_cards` replaced"""
+    grid_labels = [[None for _ in range(COLS)] for _ in range(ROWS)]
+    grid_confidences = [[0 for _ in range(COLS)] for _ in range(ROWS)]
+    seen_labels = []
+
+    boxes = r.boxes
+    for i in range(len(boxes)):
+        x1, y1, x2, y2 = map(int, boxes.xyxy[i])
+        center = ((x1 + x2) / 2 + offset[0], (y1 + y2) / 2 + offset[1])
+
+        grid_pt = cv2.perspectiveTransform(np.array([[center]], dtype=np.float32), M)[0][0]
+
+        if 0 <= grid_pt[0] < grid_size[0] and 0 <= grid_pt[1] < grid_size[1]:
+            cell_col = int(grid_pt[0] // (grid_size[0] / COLS))
+            cell_row = int(grid_pt[1] // (grid_size[1] / ROWS))
+            cell_col = min(max(cell_col, 0), COLS - 1)
+            cell_row = min(max(cell_row, 0), ROWS - 1)
+
+            label = r.names[int(boxes.cls[i])]
+            conf = float(boxes.conf[i])
+            seen_labels.append(label)
+
+            if conf > grid_confidences[cell_row][cell_col]:
+                grid_labels[cell_row][cell_col] = label
+                grid_confidences[cell_row][cell_col] = conf
+
+    return grid_labels, grid_confidences, seen_labels
+
+
+def check(r, M, grid_size):
+    labels, _, seen = place_cards_loop(r, M, grid_size)
+    grid = place_cards(r, M, grid_size)
+    expected_seen = list(dict.fromkeys(seen))
+    actual_seen = [r.names[c] for c in grid.seen]
+    assert grid.labels() == [label for row in labels for label in row], "cell labels differ"
+    assert actual_seen == expected_seen, "first-seen order differs"
+
+
+def time_per_call(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", default="6,12,50,200,1000", help="comma-separated detection counts")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    M, grid_size = create_grid_matrix(GRID_POINTS)
+
+    print(f"{'boxes':>6} {'loop us':>10} {'vectorized us':>14} {'speedup':>8}")
+    for count in (int(c) for c in args.counts.split(",") if c):
+        r = synthetic_result(rng, count)
+        check(r, M, grid_size)
+        loop = time_per_call(lambda: place_cards_loop(r, M, grid_size), args.iterations)
+        vectorized = time_per_call(lambda: place_cards(r, M, grid_size), args.iterations)
+        print(f"{count:>6} {loop * 1e6:>10.1f} {vectorized * 1e6:>14.1f} {loop / vectorized:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
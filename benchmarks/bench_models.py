@@ -0,0 +1,224 @@
+"""Benchmark every registered model, directly and through the /process endpoint.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_models --output bench_results.json
+
+Frames are read from `benchmarks/frames/<action>/*.jpg`; actions without
+recorded frames get deterministic synthetic ones. Handlers that fail (e.g.
+because their weights are missing) are reported with their error count
+instead of aborting the run, so two result files can always be diffed.
+
+Each action runs in a fresh process, so its peak RSS is its own and not that
+of a heavier model benchmarked before it. The actions in SKIP_ACTIONS (resets
+and result polling, which only work after another action) are skipped; pass
+`--skip` to leave out others.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from app import app
+from models import MODELS
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Typical camera frame size per action, used for synthetic frames
+FRAME_SIZES = {
+    "xo": (240, 320),
+    "memory": (720, 1280),
+    "rubik": (480, 640),
+}
+DEFAULT_FRAME_SIZE = (480, 640)
+
+# Actions that keep state between calls and the action that resets it
+RESET_ACTIONS = {"rubik": "rubikReset", "rubikFast": "rubikReset"}
+
+# Not benchmarked: they reset state or poll for another action's result
+SKIP_ACTIONS = {"memoryReset", "rubikReset", "rubikResult"}
+
+
+def synthetic_frames(action: str, count: int) -> list[bytes]:
+    rng = np.random.default_rng(zlib.crc32(action.encode()))
+    h, w = FRAME_SIZES.get(action, DEFAULT_FRAME_SIZE)
+    frames = []
+    for _ in range(count):
+        frame = rng.integers(0, 256, size=(h // 8, w // 8, 3), dtype=np.uint8)
+        frame = cv2.resize(frame, (w, h), interpolation=cv2.INTER_NEAREST)
+        ok, buf = cv2.imencode(".jpg", frame)
+        frames.append(buf.tobytes())
+    return frames
+
+
+def load_corpus(frames_dir: str, action: str, count: int) -> tuple[list[bytes], str]:
+    paths = sorted(glob.glob(os.path.join(frames_dir, action, "*.jpg")))
+    if not paths:
+        return synthetic_frames(action, count), "synthetic"
+    frames = []
+    for path in paths:
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    return frames, "recorded"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    summary = {"requests": len(latencies) + errors, "errors": errors}
+    if latencies:
+        ms = np.array(latencies) * 1000
+        summary.update(
+            p50_ms=round(float(np.percentile(ms, 50)), 3),
+            p95_ms=round(float(np.percentile(ms, 95)), 3),
+            p99_ms=round(float(np.percentile(ms, 99)), 3),
+            frames_per_sec=round(len(latencies) / elapsed, 2),
+        )
+    summary["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return summary
+
+
+def reset(action: str):
+    if action in RESET_ACTIONS and RESET_ACTIONS[action] in MODELS:
+        MODELS[RESET_ACTIONS[action]].handler(None)
+
+
+def bench_handler(action: str, frames: list[bytes], iterations: int) -> dict:
+    decoded = [cv2.imdecode(np.frombuffer(f, dtype=np.uint8), cv2.IMREAD_COLOR) for f in frames]
+    handler = MODELS[action].handler
+    latencies, errors = [], 0
+    elapsed = 0.0
+    for i in range(iterations):
+        reset(action)
+        start = time.perf_counter()
+        try:
+            handler(decoded[i % len(decoded)])
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+        elapsed += time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def bench_http(action: str, frames: list[bytes], iterations: int) -> dict:
+    client = app.test_client()
+    latencies, errors = [], 0
+    elapsed = 0.0
+    for i in range(iterations):
+        reset(action)
+        start = time.perf_counter()
+        response = client.post(f"/process?action={action}", data=frames[i % len(frames)])
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors += 1
+        elapsed += time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def warm_up(action: str, frames: list[bytes]) -> dict:
+    """First call, which includes loading the weights"""
+    frame = cv2.imdecode(np.frombuffer(frames[0], dtype=np.uint8), cv2.IMREAD_COLOR)
+    reset(action)
+    start = time.perf_counter()
+    try:
+        MODELS[action].handler(frame)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {"ms": round((time.perf_counter() - start) * 1000, 3), "error": error}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=base_dir, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def bench_action(action: str, frames_dir: str, iterations: int) -> dict:
+    frames, source = load_corpus(frames_dir, action, count=8)
+    print(f"Benchmarking {action} ({len(frames)} {source} frames)...", flush=True)
+    return {
+        "corpus": source,
+        "frames": len(frames),
+        "warmup": warm_up(action, frames),
+        "handler": bench_handler(action, frames, iterations),
+        "http": bench_http(action, frames, iterations),
+    }
+
+
+def bench_action_isolated(action: str, frames_dir: str, iterations: int) -> dict:
+    """Benchmark one action in a child process and return its results"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "result.json")
+        command = [
+            sys.executable, "-m", "benchmarks.bench_models",
+            "--single", action,
+            "--frames", frames_dir,
+            "--iterations", str(iterations),
+            "--output", output,
+        ]
+        completed = subprocess.run(command, cwd=base_dir)
+        if completed.returncode != 0 or not os.path.exists(output):
+            return {"error": f"benchmark process exited with {completed.returncode}"}
+        with open(output) as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", default=os.path.join(base_dir, "benchmarks", "frames"))
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--actions", default="", help="comma-separated subset of actions")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--skip", default="", help="comma-separated actions to leave out")
+    # Used by the parent to run one action per process
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        with open(args.output, "w") as f:
+            json.dump(bench_action(args.single, args.frames, args.iterations), f)
+        return
+
+    actions = [a for a in args.actions.split(",") if a] or sorted(MODELS)
+    skip = SKIP_ACTIONS | {a for a in args.skip.split(",") if a}
+    results = {}
+    for action in actions:
+        if action in skip:
+            print(f"Skipping {action}", flush=True)
+            continue
+        results[action] = bench_action_isolated(action, args.frames, args.iterations)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "iterations": args.iterations,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Check and benchmark the xo grid-to-cells conversion.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_xo_grid
+
+Feeds randomized noisy boards (jittered cell centres, duplicate points, pieces
+on top of empty cells, spurious points) to `convert_grid_to_cells` and to the
+list-scanning implementation it replaced, fails on the first input where they
+disagree, then times both for growing numbers of points.
+"""
+
+import argparse
+import random
+import time
+
+from models.xo import convert_grid_to_cells
+
+
+def convert_grid_to_cells_reference(grid):
+    """The previous implementation, kept as the reference output"""
+    deduplicated_grid = []
+    seen_positions = set()
+    for x, y, label in grid:
+        pos = (round(x / 5) * 5, round(y / 5) * 5)
+        if pos not in seen_positions:
+            seen_positions.add(pos)
+            deduplicated_grid.append((x, y, label))
+        else:
+            for i, (existing_x, existing_y, existing_label) in enumerate(deduplicated_grid):
+                existing_pos = (round(existing_x / 5) * 5, round(existing_y / 5) * 5)
+                if existing_pos == pos:
+                    if existing_label == "-" and label in ["X", "O"]:
+                        deduplicated_grid[i] = (x, y, label)
+                    break
+
+    sorted_grid = sorted(deduplicated_grid, key=lambda x: (x[1], x[0]))
+
+    rows = []
+    current_row = []
+    last_y = None
+    y_threshold = 10
+
+    for x, y, label in sorted_grid:
+        if last_y is None or abs(y - last_y) <= y_threshold:
+            current_row.append((x, y, label))
+        else:
+            current_row.sort(key=lambda x: x[0])
+            row = [item[2] for item in current_row]
+            row.extend(["-"] * (5 - len(row)))
+            rows.append(row[:5])
+            current_row = [(x, y, label)]
+        last_y = y
+
+    if current_row:
+        current_row.sort(key=lambda x: x[0])
+        row = [item[2] for item in current_row]
+        row.extend(["-"] * (5 - len(row)))
+        rows.append(row[:5])
+
+    cells = rows
+    while len(cells) < 3:
+        cells.append(["-"] * 5)
+    if len(cells) > 3:
+        cells = cells[:3]
+
+    return cells
+
+
+def noisy_grid(rng: random.Random, points: int):
+    """Cell centres of a 3x5 board with jitter, repeats and stray points, in random order"""
+    grid = []
+    while len(grid) < points:
+        row, col = rng.randrange(3), rng.randrange(5)
+        x = 30 + col * 45 + rng.randint(-4, 4)
+        y = 25 + row * 45 + rng.randint(-6, 6)
+        label = rng.choice(["-", "-", "X", "O"])
+        grid.append((x, y, label))
+        if rng.random() < 0.3:
+            # Same cell reported twice, e.g. by the contour pass and by YOLO
+            grid.append((x + rng.randint(-2, 2), y + rng.randint(-2, 2), rng.choice(["-", "X", "O"])))
+        if rng.random() < 0.05:
+            grid.append((rng.randint(0, 246), rng.randint(0, 145), rng.choice(["-", "X", "O"])))
+    rng.shuffle(grid)
+    return grid[:points]
+
+
+def check(cases: int, seed: int):
+    rng = random.Random(seed)
+    for case in range(cases):
+        grid = noisy_grid(rng, rng.randint(0, 40))
+        expected = convert_grid_to_cells_reference(list(grid))
+        actual = convert_grid_to_cells(list(grid))
+        if actual != expected:
+            raise AssertionError(f"Case {case} differs for {grid}:\n{actual}\n!=\n{expected}")
+    print(f"{cases} random boards: identical output")
+
+
+def time_per_call(fn, grid, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(grid)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--counts", default="15,30,100,500,2000", help="comma-separated point counts")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    check(args.cases, args.seed)
+
+    rng = random.Random(args.seed)
+    print(f"{'points':>6} {'reference us':>13} {'current us':>11} {'speedup':>8}")
+    for count in (int(c) for c in args.counts.split(",") if c):
+        grid = noisy_grid(rng, count)
+        reference = time_per_call(convert_grid_to_cells_reference, grid, args.iterations)
+        current = time_per_call(convert_grid_to_cells, grid, args.iterations)
+        print(f"{count:>6} {reference * 1e6:>13.1f} {current * 1e6:>11.1f} {reference / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
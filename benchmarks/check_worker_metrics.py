@@ -0,0 +1,43 @@
+"""Check that metrics recorded inside a worker process reach the server's /metrics.
+
+Run from the repository root:
+
+    python -m benchmarks.check_worker_metrics
+
+Calls `rubikResult` in a worker process for a new session. The call is
+rejected (no solve was started), but creating the session bumps the
+`sessions_created` counter and the `sessions` gauge in the worker, and both
+must show up in the server process's `render()`.
+"""
+
+import numpy as np
+
+import metrics
+from models.registry import Rejected
+from workers import ModelWorker
+from models import MODELS
+
+
+def main():
+    worker = ModelWorker(MODELS["rubikResult"].handler.__module__)
+    frame = np.zeros((8, 8, 3), dtype=np.uint8)
+    try:
+        worker.call("rubikResult", [frame], ["check-worker-metrics"], batch=False)
+    except Rejected:
+        pass
+    finally:
+        worker.stop()
+
+    rendered = metrics.render()
+    expected = [
+        'model_server_sessions_created_total{action="rubik"} 1',
+        'model_server_sessions{action="rubik"} 1',
+    ]
+    missing = [line for line in expected if line not in rendered.splitlines()]
+    if missing:
+        raise SystemExit(f"Missing from /metrics: {missing}\n{rendered}")
+    print("Worker counters and gauges are forwarded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+
+
+def env_list(name: str, default: str = "") -> list[str]:
+    return [item.strip() for item in os.environ.get(name, default).split(",") if item.strip()]
+
+
+def env_dict(name: str, default: str = "") -> dict[str, str]:
+    """Parse `key:value,key:value` pairs"""
+    return dict(item.split(":", 1) for item in env_list(name, default))
+
+
+# Actions whose weights are loaded at startup instead of on the first request
+PRELOAD_MODELS = env_list("PRELOAD_MODELS")
+
+# Micro-batching of concurrent /process requests, disabled when the window is 0
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", "0"))
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_ACTIONS = env_list("BATCH_ACTIONS", "xo,memory")
+# Seconds a request waits for its model (batched or in a worker process) before
+# failing with 503; generous, since the first request also loads the weights
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", "120"))
+
+# Per-action worker pool used by the ASGI server (asgi.py)
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "1"))
+INFERENCE_QUEUE = int(os.environ.get("INFERENCE_QUEUE", "4"))
+
+# Actions served from separate worker processes (one process per models/ module)
+WORKER_ACTIONS = env_list("WORKER_ACTIONS")
+
+# JPEG decode downscale per action (1, 2, 4 or 8), e.g. DECODE_SCALES=xo:2,rubik:2.
+# memory must stay at 1 because coords.txt is in full-resolution pixels.
+DECODE_SCALES = {action: int(scale) for action, scale in env_dict("DECODE_SCALES").items()}
+
+# Result cache for near-identical frames (e.g. ESP32 clients polling a static board).
+# Only list stateless actions; never rubik, which counts every scan.
+CACHE_ACTIONS = env_list("CACHE_ACTIONS")
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "2.0"))
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", "16"))
+CACHE_THRESHOLD = float(os.environ.get("CACHE_THRESHOLD", "4.0"))
+
+# How YOLO weights are run: ultralytics (PyTorch), onnx (ONNX Runtime) or openvino.
+# Exported copies are cached next to the .pt files; INT8 quantizes them.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "ultralytics")
+INFERENCE_INT8 = os.environ.get("INFERENCE_INT8", "0") == "1"
+
+# Adaptive resolution for the memory card detector: detect on the calibrated grid
+# crop, starting at the smallest imgsz and only escalating while cells are empty or
+# below MEMORY_MIN_CONF
+MEMORY_ADAPTIVE = os.environ.get("MEMORY_ADAPTIVE", "0") == "1"
+MEMORY_IMGSZ_LADDER = [int(size) for size in env_list("MEMORY_IMGSZ_LADDER", "640,960,1280,1600")]
+MEMORY_MIN_CONF = float(os.environ.get("MEMORY_MIN_CONF", "0.5"))
+MEMORY_CROP_MARGIN = float(os.environ.get("MEMORY_CROP_MARGIN", "0.15"))
+
+# Per-session state (e.g. one memory game per table), keyed by the X-Session-Id
+# header or the `session` query parameter. Idle sessions are dropped after
+# SESSION_TTL seconds and at most SESSION_MAX are kept per action.
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "1800"))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "64"))
+
+# Incremental mode for memory: per session, only cells whose pixels changed (or that
+# have fewer than MEMORY_HISTORY detections since) are detected again, and each
+# cell reports the confidence-weighted majority of its last MEMORY_HISTORY detections
+MEMORY_INCREMENTAL = os.environ.get("MEMORY_INCREMENTAL", "0") == "1"
+MEMORY_HISTORY = int(os.environ.get("MEMORY_HISTORY", "3"))
+MEMORY_CHANGE_THRESHOLD = float(os.environ.get("MEMORY_CHANGE_THRESHOLD", "8.0"))
+
+# Per-action preprocessing (ROI, resize, colour conversion) overrides, see preprocess.py.
+# With PREPROCESS_DEBUG_DIR set, each action's latest input is saved there with its ROI drawn.
+PREPROCESS_CONFIG = os.environ.get("PREPROCESS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "preprocess.json"))
+PREPROCESS_DEBUG_DIR = os.environ.get("PREPROCESS_DEBUG_DIR", "")
+
+# Columns of the 3x5 xo board that form the 3x3 playing area (the others hold spare pieces)
+XO_BOARD_COLUMNS = [int(column) for column in env_list("XO_BOARD_COLUMNS", "1,2,3")]
+
+# Serve the Rubik's solver tables from memory-mapped files shared by all processes
+# (see models/rubik_tables.py)
+RUBIK_MMAP_TABLES = os.environ.get("RUBIK_MMAP_TABLES", "1") == "1"
+
+# Rubik's solutions by cube state, persisted across restarts (least recently used dropped first)
+RUBIK_SOLUTION_CACHE = os.environ.get(
+    "RUBIK_SOLUTION_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models_files", "rubik", "solutions.json"),
+)
+RUBIK_SOLUTION_CACHE_SIZE = int(os.environ.get("RUBIK_SOLUTION_CACHE_SIZE", "256"))
+# Solve in the background: the 11th scan returns "pending" and rubikResult is polled
+RUBIK_BACKGROUND_SOLVE = os.environ.get("RUBIK_BACKGROUND_SOLVE", "0") == "1"
+# Multi-start solving: RUBIK_SOLVE_STARTS cube orientations solved on a pool of
+# RUBIK_SOLVE_PROCESSES processes, keeping the shortest solution (0 = one solve in-process)
+RUBIK_SOLVE_PROCESSES = int(os.environ.get("RUBIK_SOLVE_PROCESSES", "0"))
+RUBIK_SOLVE_STARTS = int(os.environ.get("RUBIK_SOLVE_STARTS", str(max(RUBIK_SOLVE_PROCESSES, 1))))
+# Classify stickers YOLO missed from their pixels (see models/rubik_colors.py)
+RUBIK_COLOR_FALLBACK = os.environ.get("RUBIK_COLOR_FALLBACK", "1") == "1"
@@ -0,0 +1,117 @@
+from threading import Lock
+
+from models import MODELS
+from batching import MicroBatcher
+from frame_cache import FrameCache, Fingerprint
+from sessions import DEFAULT_SESSION
+from workers import get_worker
+import config
+import metrics
+
+_batchers = {}
+_batchers_lock = Lock()
+_caches = {}
+_caches_lock = Lock()
+
+metrics.register_gauge(
+    "queue_depth",
+    lambda: [({"action": name, "queue": "batch"}, b.depth) for name, b in list(_batchers.items())],
+)
+
+
+def get_batcher(name: str):
+    """Return the micro-batcher for an action, or None if it is not batched"""
+    spec = MODELS[name]
+    if (
+        config.BATCH_WINDOW_MS <= 0
+        or spec.batch_handler is None
+        or name not in config.BATCH_ACTIONS
+    ):
+        return None
+
+    with _batchers_lock:
+        if name not in _batchers:
+            _batchers[name] = MicroBatcher(
+                name,
+                # Items are (image, session) pairs from `run_action`
+                lambda items: call_batch_handler(
+                    name, [img for img, _ in items], [session for _, session in items]
+                ),
+                max_batch_size=config.BATCH_MAX_SIZE,
+                window=config.BATCH_WINDOW_MS / 1000,
+                timeout=config.INFERENCE_TIMEOUT,
+            )
+        return _batchers[name]
+
+
+def get_cache(name: str):
+    """Return the result cache for an action, or None if it is not cached"""
+    if name not in config.CACHE_ACTIONS:
+        return None
+
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = FrameCache(config.CACHE_TTL, config.CACHE_SIZE, config.CACHE_THRESHOLD)
+        return _caches[name]
+
+
+def clear_reset_caches(name: str, session: str):
+    """Forget the session's cached results of the actions that `name` resets"""
+    for target in MODELS[name].resets:
+        cache = get_cache(target)
+        if cache is not None:
+            cache.clear(session if MODELS[target].sessions else None)
+
+
+def call_handler(name: str, img, session: str = DEFAULT_SESSION) -> str:
+    worker = get_worker(name)
+    if worker is not None:
+        return worker.call(name, [img], [session], batch=False)
+    return MODELS[name].run(img, session)
+
+
+def call_batch_handler(name: str, imgs: list, sessions: list[str]) -> list[str]:
+    worker = get_worker(name)
+    if worker is not None:
+        return worker.call(name, imgs, sessions, batch=True)
+    return MODELS[name].run_batch(imgs, sessions)
+
+
+def run_action(name: str, img, session: str = DEFAULT_SESSION) -> str:
+    # Results of session-aware actions depend on the session's state, so
+    # cached results are only shared within a session
+    scope = session if MODELS[name].sessions else None
+    cache = get_cache(name)
+    if cache is not None:
+        fp = Fingerprint(img)
+        result = cache.get(fp, scope)
+        if result is not None:
+            metrics.inc("cache_hits", action=name)
+            return result
+        metrics.inc("cache_misses", action=name)
+
+    batcher = get_batcher(name)
+    if batcher is not None:
+        result = batcher.submit((img, session))
+    else:
+        result = call_handler(name, img, session)
+
+    if cache is not None:
+        cache.put(fp, result, scope)
+    clear_reset_caches(name, session)
+    return result
+
+
+def run_action_batch(name: str, imgs: list, session: str = DEFAULT_SESSION) -> list[str]:
+    """Run an action over several images in one call, keeping the input order"""
+    spec = MODELS[name]
+    if spec.batch_handler is None:
+        results = [call_handler(name, img, session) for img in imgs]
+    else:
+        # Chunk large uploads so one request cannot build an unbounded batch
+        results = []
+        for start in range(0, len(imgs), config.BATCH_MAX_SIZE):
+            chunk = imgs[start : start + config.BATCH_MAX_SIZE]
+            results.extend(call_batch_handler(name, chunk, [session] * len(chunk)))
+    clear_reset_caches(name, session)
+    return results
@@ -0,0 +1,7 @@
+class Rejected(ValueError):
+    """Raised for a request the client should fix or retry (e.g. a scan to
+    retake); answered with `status` (422 by default) instead of 500"""
+
+    def __init__(self, message: str, status: int = 422):
+        super().__init__(message)
+        self.status = status
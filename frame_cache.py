@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import cv2
+import numpy as np
+
+
+class Fingerprint:
+    """Cheap perceptual summary of a frame: a 64-bit difference hash plus a thumbnail"""
+
+    __slots__ = ("hash", "thumb")
+
+    def __init__(self, frame: np.ndarray):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        thumb = cv2.resize(gray, (16, 16), interpolation=cv2.INTER_AREA)
+        self.thumb = thumb.astype(np.int16)
+        # dHash: compare horizontally adjacent pixels of a 9x8 thumbnail
+        small = cv2.resize(thumb, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        self.hash = int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    def distance(self, other: "Fingerprint") -> float:
+        """Largest difference of any thumbnail pixel, i.e. of any 1/16 x 1/16 block
+        of the frames. A mean over the whole thumbnail would average away a
+        single new piece or flipped card."""
+        return float(np.abs(self.thumb - other.thumb).max())
+
+
+class FrameCache:
+    """LRU cache of results for frames that look (almost) the same.
+
+    An entry matches when its hash is within `max_bits` differing bits, no
+    thumbnail block differs by more than `threshold` grey levels, and it is
+    younger than `ttl` seconds. Entries stored under a `scope` (e.g. a session
+    id) only match lookups with the same scope.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, threshold: float, max_bits: int = 4):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_bits = max_bits
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, fp: Fingerprint, scope=None):
+        now = time.monotonic()
+        with self._lock:
+            for key in reversed(self._entries):
+                entry_fp, result, expires = self._entries[key]
+                if expires < now or key[0] != scope:
+                    continue
+                if (entry_fp.hash ^ fp.hash).bit_count() > self.max_bits:
+                    continue
+                if entry_fp.distance(fp) <= self.threshold:
+                    self._entries.move_to_end(key)
+                    return result
+        return None
+
+    def put(self, fp: Fingerprint, result, scope=None):
+        now = time.monotonic()
+        with self._lock:
+            # Expired entries go first, then the least recently used
+            for key in [k for k, (_, _, expires) in self._entries.items() if expires < now]:
+                del self._entries[key]
+            key = (scope, fp.hash)
+            self._entries[key] = (fp, result, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, scope=None):
+        """Drop the entries stored under `scope`, or all entries without one"""
+        with self._lock:
+            if scope is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == scope]:
+                del self._entries[key]
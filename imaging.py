@@ -0,0 +1,46 @@
+import struct
+
+import cv2
+import numpy as np
+
+# Each frame in a length-prefixed stream starts with its size as a big-endian uint32
+FRAME_HEADER = struct.Struct(">I")
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 of the full resolution
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def decode_image(data, scale: int = 1) -> np.ndarray:
+    """Decode an encoded image from bytes or a file-like object into a BGR array.
+
+    The request buffer is wrapped without copying and decoded directly into
+    the BGR layout the models use; `scale` decodes at 1/scale resolution.
+    """
+    if hasattr(data, "read"):
+        data = data.read()
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), DECODE_FLAGS[scale])
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+
+def split_frames(data: bytes) -> list[memoryview]:
+    """Split a concatenated length-prefixed stream into the individual encoded frames"""
+    view = memoryview(data)
+    frames = []
+    offset = 0
+    while offset < len(view):
+        if offset + FRAME_HEADER.size > len(view):
+            raise ValueError(f"Truncated frame header at byte {offset}")
+        (size,) = FRAME_HEADER.unpack_from(view, offset)
+        offset += FRAME_HEADER.size
+        if size == 0 or offset + size > len(view):
+            raise ValueError(f"Invalid frame length {size} at byte {offset}")
+        frames.append(view[offset : offset + size])
+        offset += size
+    return frames
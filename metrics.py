@@ -0,0 +1,150 @@
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+PREFIX = "model_server"
+
+# Upper bounds in seconds, from a fast contour pass up to a cold model load
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+_lock = Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+# Gauge values reported by worker processes, by (name, labels)
+_remote_gauges = {}
+_buffer = None
+
+
+def observe(action: str, stage: str, seconds: float):
+    with _lock:
+        if _buffer is not None:
+            _buffer.append(("observe", action, stage, seconds))
+            return
+        key = (action, stage)
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(seconds)
+
+
+@contextmanager
+def timed(action: str, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(action, stage, time.perf_counter() - start)
+
+
+def inc(name: str, amount: int = 1, **labels):
+    with _lock:
+        key = (name, tuple(sorted(labels.items())))
+        if _buffer is not None:
+            _buffer.append(("inc", key, amount))
+            return
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_gauge(name: str, fn):
+    """`fn` returns a list of (labels, value) pairs and is called on every scrape"""
+    _gauges.setdefault(name, []).append(fn)
+
+
+def start_buffering():
+    """Keep observations and counter increments in a list for `drain` instead
+    of recording them here.
+
+    Used by worker processes, which send them back to the server process
+    along with each result, together with the current values of their gauges.
+    """
+    global _buffer
+    with _lock:
+        _buffer = []
+
+
+def drain() -> list:
+    global _buffer
+    gauges = [
+        ("gauge", (name, tuple(sorted(labels.items()))), value)
+        for name, fns in list(_gauges.items())
+        for fn in fns
+        for labels, value in fn()
+    ]
+    with _lock:
+        samples, _buffer = _buffer, []
+    return samples + gauges
+
+
+def merge(samples: list):
+    for kind, *sample in samples:
+        if kind == "observe":
+            observe(*sample)
+            continue
+        key, value = sample
+        with _lock:
+            if kind == "inc":
+                _counters[key] = _counters.get(key, 0) + value
+            else:
+                _remote_gauges[key] = value
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels.items())
+
+
+def render() -> str:
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+
+    name = f"{PREFIX}_stage_seconds"
+    lines.append(f"# HELP {name} Time spent per request in each processing stage")
+    lines.append(f"# TYPE {name} histogram")
+    for (action, stage), hist in histograms:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, hist.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{_labels(action=action, stage=stage)},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{_labels(action=action, stage=stage)},le="+Inf"}} {hist.count}')
+        lines.append(f"{name}_sum{{{_labels(action=action, stage=stage)}}} {hist.sum}")
+        lines.append(f"{name}_count{{{_labels(action=action, stage=stage)}}} {hist.count}")
+
+    for counter in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {PREFIX}_{counter}_total counter")
+        for (name, labels), value in counters:
+            if name == counter:
+                lines.append(f"{PREFIX}_{counter}_total{{{_labels(**dict(labels))}}} {value}")
+
+    gauges = {}
+    for gauge, fns in list(_gauges.items()):
+        for fn in fns:
+            for labels, value in fn():
+                gauges[(gauge, tuple(sorted(labels.items())))] = value
+    # A worker's value replaces the server process's own copy of the same gauge
+    with _lock:
+        gauges.update(_remote_gauges)
+    for gauge in sorted({name for name, _ in gauges}):
+        lines.append(f"# TYPE {PREFIX}_{gauge} gauge")
+        for (name, labels), value in sorted(gauges.items()):
+            if name == gauge:
+                lines.append(f"{PREFIX}_{gauge}{{{_labels(**dict(labels))}}} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,69 @@
+import os
+
+from logger import logger
+
+# Backends the YOLO weights can be exported to and run with on CPU
+BACKENDS = ("ultralytics", "onnx", "openvino")
+
+
+def exported_path(weights_path: str, backend: str, int8: bool) -> str:
+    """Where the exported copy of a .pt file is cached, next to the weights"""
+    stem, _ = os.path.splitext(weights_path)
+    if backend == "onnx":
+        return f"{stem}.int8.onnx" if int8 else f"{stem}.onnx"
+    if backend == "openvino":
+        return f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+    return weights_path
+
+
+def is_stale(path: str, weights_path: str) -> bool:
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(weights_path)
+
+
+def export(weights_path: str, backend: str, int8: bool) -> str:
+    """Export the weights once and return the cached file; re-exports when the .pt changes"""
+    from ultralytics import YOLO
+
+    path = exported_path(weights_path, backend, int8)
+    if not is_stale(path, weights_path):
+        return path
+
+    logger.info(f"Exporting {weights_path} to {path}")
+    model = YOLO(weights_path)
+    if backend == "onnx":
+        # Dynamic axes keep batched predict and per-call imgsz working
+        onnx_path = model.export(format="onnx", dynamic=True)
+        if not int8:
+            return onnx_path
+
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(onnx_path, path, weight_type=QuantType.QUInt8)
+        return path
+
+    exported = str(model.export(format="openvino", dynamic=True, int8=int8))
+    if int8 and os.path.normpath(exported) != os.path.normpath(path):
+        # ultralytics exports FP32 when INT8 calibration is unavailable (e.g. without nncf)
+        logger.warning(f"OpenVINO INT8 export of {weights_path} fell back to FP32: {exported}")
+    return exported
+
+
+def load(weights_path: str, backend: str, int8: bool = False, **kwargs):
+    """Load a YOLO model with the given backend, falling back to the .pt weights.
+
+    Exported models still run through ultralytics' YOLO wrapper for pre- and
+    post-processing, so ultralytics and torch are imported with every backend.
+    """
+    from ultralytics import YOLO
+
+    if backend not in BACKENDS:
+        logger.warning(f"Unknown inference backend '{backend}', using ultralytics")
+        backend = "ultralytics"
+
+    if backend != "ultralytics":
+        try:
+            return YOLO(export(weights_path, backend, int8), task="detect", **kwargs), backend
+        except Exception as e:
+            logger.warning(f"Could not use {backend} for {weights_path}, using ultralytics: {e}")
+
+    return YOLO(weights_path, **kwargs), "ultralytics"
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from logger import logger
+
+
+class GridGeometry:
+    """Perspective transform and cell size precomputed for one set of grid corners"""
+
+    def __init__(self, points, M, grid_size, rows: int, cols: int):
+        self.points = points
+        self.M = M
+        self.grid_size = grid_size
+        self.cell_size = (grid_size[0] / cols, grid_size[1] / rows)
+
+
+def parse_points(text: str) -> list[tuple[int, int]]:
+    """Parse one `x,y` pair per line, the format of coords.txt"""
+    points = []
+    for line in text.splitlines():
+        if line.strip():
+            x, y = map(int, line.strip().split(","))
+            points.append((x, y))
+    return points
+
+
+def validate_points(points) -> list[tuple[int, int]]:
+    points = [(int(x), int(y)) for x, y in points]
+    if len(points) != 4:
+        raise ValueError(f"Expected 4 points, but found {len(points)}")
+
+    # The corners must form a proper convex quadrilateral
+    hull = cv2.convexHull(np.array(points, dtype=np.float32))
+    if len(hull) != 4 or cv2.contourArea(hull) < 100:
+        raise ValueError(f"Points do not form a convex quadrilateral: {points}")
+    return points
+
+
+class GridCalibration:
+    """Grid corners loaded once from a coords file, with the derived geometry cached.
+
+    A background thread polls the file's modification time so edits (or
+    `update`) take effect without touching the file on the per-frame path.
+    Without a valid file, an automatic grid covering the central 80% of the
+    frame is used, cached per frame size.
+    """
+
+    def __init__(self, path: str, build, rows: int, cols: int, poll_interval: float = 2.0):
+        self.path = path
+        self.build = build
+        self.rows = rows
+        self.cols = cols
+        self.poll_interval = poll_interval
+        self._geometry = None
+        self._auto = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    @property
+    def points(self):
+        if self._watcher is None:
+            self.start()
+        geometry = self._geometry
+        return geometry.points if geometry is not None else None
+
+    def geometry(self, frame_shape) -> GridGeometry:
+        if self._watcher is None:
+            self.start()
+
+        geometry = self._geometry
+        if geometry is not None:
+            return geometry
+
+        h, w = frame_shape[:2]
+        if (h, w) not in self._auto:
+            points = [
+                (int(w*0.1), int(h*0.1)),   # top-left
+                (int(w*0.9), int(h*0.1)),   # top-right
+                (int(w*0.9), int(h*0.9)),   # bottom-right
+                (int(w*0.1), int(h*0.9))    # bottom-left
+            ]
+            logger.info(f"Using automatic grid points for {w}x{h} frames")
+            self._auto[(h, w)] = self._make_geometry(points)
+        return self._auto[(h, w)]
+
+    def start(self):
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self.reload()
+            self._watcher = threading.Thread(target=self._watch, name="grid-calibration", daemon=True)
+            self._watcher.start()
+
+    def reload(self):
+        """Re-read the coords file; an invalid file keeps the previous calibration"""
+        if not os.path.exists(self.path):
+            if self._geometry is not None or self._mtime is None:
+                logger.warning(f"{self.path} not found")
+            self._geometry = None
+            self._mtime = None
+            return
+
+        mtime = os.path.getmtime(self.path)
+        try:
+            with open(self.path, "r") as f:
+                points = validate_points(parse_points(f.read()))
+        except Exception as e:
+            logger.error(f"Error loading coordinates from {self.path}: {e}")
+            self._mtime = mtime
+            return
+
+        self._geometry = self._make_geometry(points)
+        self._mtime = mtime
+        logger.info(f"Using grid points from {os.path.basename(self.path)}: {points}")
+
+    def update(self, points):
+        """Validate and store new corners, replacing the coords file atomically"""
+        points = validate_points(points)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(f"{x},{y}" for x, y in points))
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self.reload()
+
+    def _make_geometry(self, points) -> GridGeometry:
+        M, grid_size = self.build(points)
+        return GridGeometry(points, M, grid_size, self.rows, self.cols)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+                if mtime != self._mtime:
+                    with self._lock:
+                        self.reload()
+            except Exception as e:
+                logger.error(f"Error watching {self.path}: {e}")
@@ -4,7 +4,6 @@ import time
 from .registry import register_model
 from threading import Lock
 from .registry import register_model
-from PIL import Image
 from logger import logger
 import copy
 
@@ -297,7 +296,7 @@ def cups_ai(required_objects=1):
 
 
 @register_model("cupsResult")
-def cups_result(img: Image.Image) -> str:
+def cups_result(img: np.ndarray) -> str:
     global final_result
     with lock:
         if (
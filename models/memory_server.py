@@ -1,27 +1,40 @@
-from .registry import register_model
-from PIL import Image
+from .registry import register_model, register_batch_handler, LazyYOLO
+from .calibration import GridCalibration
+from collections import deque
+from threading import Lock
 import cv2
 import numpy as np
 import os
-from ultralytics import YOLO
 from logger import logger
+from sessions import DEFAULT_SESSION, SessionStore
+from preprocess import get_pipeline
+import metrics
+import config
 
 # Constants for the grid
 ROWS = 2
 COLS = 3
 
-state_mapping = {}
-next_state = 0
+# Minimum detection confidence; an empty cell counts as a vote of this weight
+DETECT_CONF = 0.3
+# Side of the per-cell thumbnails compared by the incremental mode
+THUMB_SIZE = 16
+# imgsz must be a multiple of the detector's largest stride
+STRIDE = 32
 
-base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-model_path = os.path.join(base_dir, "models_files", "yolo11_cards.pt")
+class GameState:
+    """Card label to state value mapping of one game (one table)"""
     
-logger.info(f"Loading YOLO model from {model_path}")
-try:
-    model = YOLO(model_path)
-    logger.info("Matrix cards model loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading YOLO model: {e}")
+    def __init__(self):
+        self.state_mapping = {}
+        self.next_state = 0
+        self.lock = Lock()
+        self.history = GridHistory(config.MEMORY_HISTORY)
+
+# One game per session, so a single server can track several tables
+games = SessionStore("memory", GameState, config.SESSION_TTL, config.SESSION_MAX)
+
+model = LazyYOLO("yolo11_cards.pt")
 
 def order_points(pts):
     """Order points in top-left, top-right, bottom-right, bottom-left order"""
@@ -63,119 +76,323 @@ def create_grid_matrix(points, rows=ROWS, cols=COLS):
     M = cv2.getPerspectiveTransform(src_pts, dst_pts)
     return M, (int(target_width), int(target_height))
 
+# Grid corners are read once and reloaded when coords.txt changes
+calibration = GridCalibration(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "coords.txt"),
+    create_grid_matrix,
+    ROWS,
+    COLS,
+)
+
 def load_grid_coordinates():
     """Load grid coordinates from file"""
-    coords_file = 'coords.txt'
-    now_path = os.path.dirname(os.path.abspath(__file__))
-    coords_file = os.path.join(now_path, coords_file)
-    if not coords_file or not os.path.exists(coords_file):
-        logger.warning(f"{coords_file} not found")
-        return None
-    
-    points = []
-    try:
-        with open(coords_file, 'r') as f:
-            for line in f:
-                x, y = map(int, line.strip().split(','))
-                points.append((x, y))
+    return calibration.points
+
+def grid_transform(frame):
+    """Get the perspective transform and grid size for a frame"""
+    geometry = calibration.geometry(frame.shape)
+    return geometry.M, geometry.grid_size
+
+def grid_roi(geometry, frame_shape, margin):
+    """Bounding box of the grid corners, grown by `margin` so edge cards stay whole"""
+    return points_roi(np.array(geometry.points), frame_shape, margin)
+
+def cells_roi(geometry, cells, frame_shape):
+    """Bounding box in the frame of the given cells, grown by half a cell on each side"""
+    cw, ch = geometry.cell_size
+    corners = []
+    for i in np.flatnonzero(cells):
+        row, col = divmod(int(i), COLS)
+        x0, y0 = (col - 0.5) * cw, (row - 0.5) * ch
+        x1, y1 = (col + 1.5) * cw, (row + 1.5) * ch
+        corners += [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+    pts = cv2.perspectiveTransform(
+        np.array(corners, dtype=np.float32).reshape(-1, 1, 2), np.linalg.inv(geometry.M))
+    return points_roi(pts.reshape(-1, 2), frame_shape, 0)
+
+def points_roi(pts, frame_shape, margin):
+    x0, y0 = pts.min(axis=0)
+    x1, y1 = pts.max(axis=0)
+    mx, my = (x1 - x0) * margin, (y1 - y0) * margin
+    h, w = frame_shape[:2]
+    return (
+        max(int(x0 - mx), 0),
+        max(int(y0 - my), 0),
+        min(int(x1 + mx), w),
+        min(int(y1 + my), h),
+    )
+
+class CardGrid:
+    """Most confident card per cell, row-major: class id (-1 when empty) and confidence"""
+    
+    def __init__(self, cls, conf, seen, names):
+        self.cls = cls
+        self.conf = conf
+        # In-grid class ids in order of first detection, which decides the
+        # order they get state values in
+        self.seen = seen
+        self.names = names
+    
+    def labels(self):
+        return [self.names[int(c)] if c >= 0 else None for c in self.cls]
+    
+    def is_confident(self, min_conf, cells=None):
+        """True when every cell (or every cell in the `cells` mask) has a card
+        detected with at least `min_conf`"""
+        cls, conf = (self.cls, self.conf) if cells is None else (self.cls[cells], self.conf[cells])
+        return bool((cls >= 0).all() and (conf >= min_conf).all())
+
+def cell_thumbnails(frame, geometry):
+    """Grey THUMB_SIZE x THUMB_SIZE thumbnail of every cell, row-major"""
+    # Warp at 4x the thumbnail size, then average down to keep out sensor noise
+    w, h = COLS * THUMB_SIZE * 4, ROWS * THUMB_SIZE * 4
+    S = np.diag([w / geometry.grid_size[0], h / geometry.grid_size[1], 1.0])
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    warped = cv2.warpPerspective(gray, S @ geometry.M, (w, h), flags=cv2.INTER_LINEAR)
+    small = cv2.resize(warped, (COLS * THUMB_SIZE, ROWS * THUMB_SIZE), interpolation=cv2.INTER_AREA)
+    return (
+        small.reshape(ROWS, THUMB_SIZE, COLS, THUMB_SIZE)
+        .swapaxes(1, 2)
+        .reshape(ROWS * COLS, THUMB_SIZE, THUMB_SIZE)
+        .astype(np.int16)
+    )
+
+class GridHistory:
+    """Recent detections per cell of one table, for incremental detection.
+    
+    A cell is detected again while it has fewer than `size` detections since
+    its pixels last changed; after that it is settled and skipped until its
+    thumbnail moves more than MEMORY_CHANGE_THRESHOLD grey levels away from
+    the one it was last detected on.
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        self.geometry = None
+        self.thumbs = None
+        self.names = {}
+        self.cells = [deque(maxlen=size) for _ in range(ROWS * COLS)]
+        self.lock = Lock()
+    
+    def pending(self, geometry, thumbs, threshold):
+        """Mask of the cells that need detecting in the frame with these thumbnails"""
+        if geometry is not self.geometry or self.thumbs is None:
+            # First frame or new calibration: start over
+            self.geometry = geometry
+            self.thumbs = thumbs.copy()
+            for cell in self.cells:
+                cell.clear()
         
-        if len(points) != 4:
-            logger.warning(f"Expected 4 points in {coords_file}, but found {len(points)}")
-            return None
-            
-        return points
-    except Exception as e:
-        logger.error(f"Error loading coordinates: {e}")
-        return None
-
-@register_model("memory")
-def process_image(pil_img: Image.Image) -> str:
-    """Process an image to detect cards in a grid and return a comma-separated string result"""
-    global state_mapping, next_state
-    # Convert PIL Image to OpenCV format
-    frame = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-    
-    # Get grid points - first try from file, then use default
-    points = load_grid_coordinates()
-    
-    # If no points are available, use automatic grid
-    if points is None:
-        h, w = frame.shape[:2]
-        points = [
-            (int(w*0.1), int(h*0.1)),   # top-left
-            (int(w*0.9), int(h*0.1)),   # top-right
-            (int(w*0.9), int(h*0.9)),   # bottom-right
-            (int(w*0.1), int(h*0.9))    # bottom-left
-        ]
-        logger.info("Using automatic grid points")
-    else:
-        logger.info("Using grid points from coords.txt")
+        changed = np.abs(thumbs - self.thumbs).mean(axis=(1, 2)) > threshold
+        for i in np.flatnonzero(changed):
+            self.cells[i].clear()
+        return np.array([len(cell) < self.size for cell in self.cells])
+    
+    def observe(self, grid, cells, thumbs):
+        self.names = grid.names
+        for i in np.flatnonzero(cells):
+            self.cells[i].append((int(grid.cls[i]), float(grid.conf[i])))
+            self.thumbs[i] = thumbs[i]
     
-    # Create transform matrix
-    M, grid_size = create_grid_matrix(points)
+    def smoothed(self):
+        """Confidence-weighted majority of each cell's recent detections"""
+        cell_cls = np.full(ROWS * COLS, -1, dtype=np.int64)
+        cell_conf = np.zeros(ROWS * COLS, dtype=np.float32)
+        for i, cell in enumerate(self.cells):
+            votes = {}
+            for cls, conf in cell:
+                votes[cls] = votes.get(cls, 0.0) + (conf if cls >= 0 else DETECT_CONF)
+            if votes:
+                cls = max(votes, key=votes.get)
+                cell_cls[i] = cls
+                cell_conf[i] = votes[cls] / sum(votes.values())
+        seen = list(dict.fromkeys(c for c in cell_cls.tolist() if c >= 0))
+        return CardGrid(cell_cls, cell_conf, seen, self.names)
+
+def as_numpy(values):
+    return values.cpu().numpy() if hasattr(values, "cpu") else np.asarray(values)
+
+def place_cards(r, M, grid_size, offset=(0, 0)):
+    """Place the detected cards into the grid, keeping the most confident card per cell"""
+    boxes = r.boxes
+    cells = ROWS * COLS
+    cell_cls = np.full(cells, -1, dtype=np.int64)
+    cell_conf = np.zeros(cells, dtype=np.float32)
+    if len(boxes) == 0:
+        return CardGrid(cell_cls, cell_conf, [], r.names)
     
-    # Initialize grid for card detection
-    grid_labels = [[None for _ in range(COLS)] for _ in range(ROWS)]
-    grid_confidences = [[0 for _ in range(COLS)] for _ in range(ROWS)]
+    # Box centers (on integer pixel corners) for all detections at once
+    xyxy = np.trunc(as_numpy(boxes.xyxy))
+    centers = (xyxy[:, :2] + xyxy[:, 2:]) / 2 + np.asarray(offset, dtype=np.float32)
     
-    # Run detection
-    results = model.predict(
-        source=frame,
-        conf=0.3,
-        imgsz=1600,
-        verbose=False,
+    # Transform all center points to grid coordinates in one call
+    grid_pts = cv2.perspectiveTransform(
+        centers.reshape(-1, 1, 2).astype(np.float32), M).reshape(-1, 2)
+    inside = (
+        (grid_pts[:, 0] >= 0) & (grid_pts[:, 0] < grid_size[0])
+        & (grid_pts[:, 1] >= 0) & (grid_pts[:, 1] < grid_size[1])
     )
     
-    # Process detection results
-    for r in results:
-        boxes = r.boxes
-        for i in range(len(boxes)):
-            x1, y1, x2, y2 = map(int, boxes.xyxy[i])
-            center = ((x1 + x2) / 2, (y1 + y2) / 2)
-            
-            # Transform center point to grid coordinates
-            grid_pt = cv2.perspectiveTransform(
-                np.array([[center]], dtype=np.float32), M)[0][0]
-            
-            if 0 <= grid_pt[0] < grid_size[0] and 0 <= grid_pt[1] < grid_size[1]:
-                cell_col = int(grid_pt[0] // (grid_size[0] / COLS))
-                cell_row = int(grid_pt[1] // (grid_size[1] / ROWS))
-                cell_col = min(max(cell_col, 0), COLS - 1)
-                cell_row = min(max(cell_row, 0), ROWS - 1)
-                
-                label = r.names[int(boxes.cls[i])]
-                conf = float(boxes.conf[i])
-                
-                # Map the label to a numeric state if not already mapped
-                if label not in state_mapping and len(state_mapping) < 3:
-                    state_mapping[label] = next_state
-                    next_state += 1
-                    logger.info(f"New state mapping: {label} → {next_state-1}")
-                
-                if conf > grid_confidences[cell_row][cell_col]:
-                    grid_labels[cell_row][cell_col] = label
-                    grid_confidences[cell_row][cell_col] = conf
-    
-        # Format the results as a comma-separated string of state values
-    state_list = []
-    label_list = []
-    for row in range(ROWS):
-        for col in range(COLS):
-            if grid_labels[row][col] is not None:
-                # Get the state value or -1 if not in mapping
-                state_value = state_mapping.get(grid_labels[row][col], -1)
-                state_list.append(str(state_value))
-
-                label_list.append(grid_labels[row][col])
-            else:
-                # Empty cell gets state -1
-                state_list.append("-1")
-                label_list.append("-1")
+    cls = as_numpy(boxes.cls).astype(np.int64)[inside]
+    conf = as_numpy(boxes.conf).astype(np.float32)[inside]
+    grid_pts = grid_pts[inside]
+    if len(cls) == 0:
+        return CardGrid(cell_cls, cell_conf, [], r.names)
+    
+    # Points are inside the grid, so only the upper bound needs clamping
+    cell_col = np.minimum((grid_pts[:, 0] // (grid_size[0] / COLS)).astype(np.int64), COLS - 1)
+    cell_row = np.minimum((grid_pts[:, 1] // (grid_size[1] / ROWS)).astype(np.int64), ROWS - 1)
+    cell = cell_row * COLS + cell_col
+    
+    # Sort by cell, then confidence (highest first), then detection order, and
+    # keep the first detection of each cell
+    order = np.lexsort((np.arange(len(cell)), -conf, cell))
+    sorted_cell = cell[order]
+    first = order[np.concatenate(([True], sorted_cell[1:] != sorted_cell[:-1]))]
+    cell_cls[cell[first]] = cls[first]
+    cell_conf[cell[first]] = conf[first]
+    
+    seen = list(dict.fromkeys(cls.tolist()))
+    
+    return CardGrid(cell_cls, cell_conf, seen, r.names)
+
+def format_grid(grid, game):
+    """Map the grid labels to the game's state values and return them comma-separated"""
+    labels = grid.labels()
+    with game.lock:
+        # Map the labels to numeric states if not already mapped
+        for label in (grid.names[c] for c in grid.seen):
+            if label not in game.state_mapping and len(game.state_mapping) < 3:
+                game.state_mapping[label] = game.next_state
+                game.next_state += 1
+                logger.info(f"New state mapping: {label} → {game.next_state-1}")
+        
+        # Format the results as a comma-separated string of state values,
+        # empty cells get state -1
+        state_list = [str(game.state_mapping.get(label, -1)) if label is not None else "-1" for label in labels]
+        mapping = dict(game.state_mapping)
+    label_list = [label if label is not None else "-1" for label in labels]
     
     # Join with commas to create a simple CSV string
     output = ",".join(state_list)
-    logger.info(f"Current state mapping: {state_mapping}")
+    logger.info(f"Current state mapping: {mapping}")
     logger.info(f"Matrix cards result (state values): {output}")
     logger.info(f"Matrix cards result (labels): {','.join(label_list)}")
     
-    return output
\ No newline at end of file
+    return output
+
+def detect_crops(frames, geometries, rois, ladder, cells=None):
+    """Detect on frame crops, starting at the smallest imgsz in `ladder` and only
+    escalating frames whose cells (or `cells` masks) are not all confident"""
+    # Slices are views, no copy
+    crops = [f[y0:y1, x0:x1] for f, (x0, y0, x1, y1) in zip(frames, rois)]
+    
+    placements = [None] * len(frames)
+    pending = list(range(len(frames)))
+    for step, imgsz in enumerate(ladder):
+        with metrics.timed("memory", "inference"):
+            results = model.predict(
+                source=[crops[i] for i in pending],
+                conf=DETECT_CONF,
+                imgsz=imgsz,
+                verbose=False,
+            )
+        
+        escalate = []
+        with metrics.timed("memory", "postprocess"):
+            for i, r in zip(pending, results):
+                g = geometries[i]
+                placements[i] = place_cards(r, g.M, g.grid_size, rois[i][:2])
+                mask = None if cells is None else cells[i]
+                if step < len(ladder) - 1 and not placements[i].is_confident(config.MEMORY_MIN_CONF, mask):
+                    escalate.append(i)
+                elif len(ladder) > 1:
+                    metrics.inc("memory_imgsz", action="memory", imgsz=imgsz)
+        
+        if escalate:
+            metrics.inc("memory_escalations", len(escalate), action="memory", imgsz=imgsz)
+        pending = escalate
+        if not pending:
+            break
+    
+    return placements
+
+def detection_ladder():
+    return config.MEMORY_IMGSZ_LADDER if config.MEMORY_ADAPTIVE else [1600]
+
+def scaled_ladder(ladder, roi, shape):
+    """The imgsz ladder for a crop, scaled so cards keep the size they have when
+    the whole frame is detected at each step (imgsz applies to the longer side)"""
+    x0, y0, x1, y1 = roi
+    scale = max(x1 - x0, y1 - y0) / max(shape[:2])
+    sizes = [max(STRIDE, round(imgsz * scale / STRIDE) * STRIDE) for imgsz in ladder]
+    # Small crops can map several steps to the same size
+    return list(dict.fromkeys(sizes))
+
+def detect_full(frames):
+    """Detect on the full frames at the maximum resolution"""
+    with metrics.timed("memory", "preprocess"):
+        geometries = [calibration.geometry(frame.shape) for frame in frames]
+        rois = [(0, 0, f.shape[1], f.shape[0]) for f in frames]
+    
+    return detect_crops(frames, geometries, rois, detection_ladder())
+
+def detect_adaptive(frames):
+    """Detect on the grid crop, starting small and escalating imgsz only where needed"""
+    with metrics.timed("memory", "preprocess"):
+        geometries = [calibration.geometry(frame.shape) for frame in frames]
+        rois = [grid_roi(g, f.shape, config.MEMORY_CROP_MARGIN) for f, g in zip(frames, geometries)]
+    
+    return detect_crops(frames, geometries, rois, detection_ladder())
+
+def detect_incremental(frame, history):
+    """Detect only the cells that changed or are not settled yet, and return the
+    smoothed grid of the table"""
+    with history.lock:
+        with metrics.timed("memory", "preprocess"):
+            geometry = calibration.geometry(frame.shape)
+            thumbs = cell_thumbnails(frame, geometry)
+            cells = history.pending(geometry, thumbs, config.MEMORY_CHANGE_THRESHOLD)
+        
+        if cells.any():
+            roi = cells_roi(geometry, cells, frame.shape)
+            ladder = scaled_ladder(detection_ladder(), roi, frame.shape)
+            grid = detect_crops([frame], [geometry], [roi], ladder, [cells])[0]
+            history.observe(grid, cells, thumbs)
+            metrics.inc("memory_cells_detected", int(cells.sum()), action="memory")
+        else:
+            metrics.inc("memory_frames_skipped", action="memory")
+        
+        return history.smoothed()
+
+def detect_cards_batch(frames, sessions):
+    """Run one detection pass over several BGR frames and return one result string per frame"""
+    games_by_frame = [games.get(session) for session in sessions]
+    # The grid corners are in the pixels of the preprocessed frames
+    pipeline = get_pipeline("memory")
+    frames = [pipeline.run(frame) for frame in frames]
+    if config.MEMORY_INCREMENTAL:
+        # Each frame builds on the previous one of its table, so they run in order
+        placements = [detect_incremental(frame, game.history) for frame, game in zip(frames, games_by_frame)]
+    elif config.MEMORY_ADAPTIVE:
+        placements = detect_adaptive(frames)
+    else:
+        placements = detect_full(frames)
+    
+    # Frames of one batch may come from different tables
+    return [format_grid(grid, game) for grid, game in zip(placements, games_by_frame)]
+
+@register_model("memory", weights=[model], sessions=True)
+def process_image(frame: np.ndarray, session: str = DEFAULT_SESSION) -> str:
+    """Process an image to detect cards in a grid and return a comma-separated string result"""
+    return detect_cards_batch([frame], [session])[0]
+
+@register_batch_handler("memory")
+def process_images(frames: list[np.ndarray], sessions: list[str] = None) -> list[str]:
+    return detect_cards_batch(frames, sessions or [DEFAULT_SESSION] * len(frames))
+
+@register_model("memoryReset", sessions=True, resets=["memory"])
+def reset_memory(frame: np.ndarray, session: str = DEFAULT_SESSION) -> str:
+    """Forget the session's card mapping so a new game can start on the same table"""
+    games.drop(session)
+    return "1"
@@ -1,26 +1,150 @@
-from typing import Callable, Dict, Optional, Any
-from PIL import Image
+from typing import Callable, Dict, Iterable, List, Optional, Any
+from threading import Lock
+import numpy as np
 import requests
 import logging
+import os
 
-MODELS: Dict[str, Callable[[Image.Image], str]] = {}
+from errors import Rejected  # noqa: F401 - raised by handlers
+from logger import logger
+from . import backends
+import config
 
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEIGHTS_DIR = os.path.join(base_dir, "models_files")
 
-def register_model(name: str):
-    def decorator(fn: Callable[[Image.Image], str]):
-        MODELS[name] = fn
+
+class LazyYOLO:
+    """YOLO weights that are only loaded the first time they are used"""
+
+    def __init__(self, filename: str, device: Optional[str] = None, **kwargs):
+        self.filename = filename
+        self.path = os.path.join(WEIGHTS_DIR, filename)
+        self.device = device
+        self.kwargs = kwargs
+        self.backend = None
+        self._model = None
+        self._lock = Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        if self._model is not None:
+            return self._model
+
+        with self._lock:
+            if self._model is None:
+                # torch and ultralytics are only imported once a model is needed
+                logger.info(f"Loading YOLO model from {self.path}")
+                model, self.backend = backends.load(
+                    self.path, config.INFERENCE_BACKEND, config.INFERENCE_INT8, **self.kwargs
+                )
+                # Exported models pick their own (CPU) device
+                if self.device is not None and self.backend == "ultralytics":
+                    model.model.to(resolve_device(self.device))
+                self._model = model
+                logger.info(f"Model {self.filename} loaded successfully ({self.backend})")
+
+        return self._model
+
+    def __getattr__(self, item):
+        # Only reached for attributes not set in __init__, e.g. `predict`
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+
+def resolve_device(device: str) -> str:
+    if device != "auto":
+        return device
+
+    import torch
+
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
+class ModelSpec:
+    """Lightweight descriptor for a registered action"""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable,
+        weights: Iterable[LazyYOLO] = (),
+        sessions: bool = False,
+        resets: Iterable[str] = (),
+    ):
+        self.name = name
+        self.handler = handler
+        self.weights = tuple(weights)
+        # Session-aware handlers also take the session id (a list of them when batched)
+        self.sessions = sessions
+        # Actions whose cached results of the session are stale after this one runs
+        self.resets = tuple(resets)
+        # Optional handler taking a list of images and returning a list of results
+        self.batch_handler: Optional[Callable[[List[np.ndarray]], List[str]]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return all(w.loaded for w in self.weights)
+
+    def load(self):
+        for w in self.weights:
+            w.load()
+
+    def __call__(self, img):
+        return self.handler(img)
+
+    def run(self, img, session: str) -> str:
+        if self.sessions:
+            return self.handler(img, session)
+        return self.handler(img)
+
+    def run_batch(self, imgs: List[np.ndarray], sessions: List[str]) -> List[str]:
+        if self.sessions:
+            return self.batch_handler(imgs, sessions)
+        return self.batch_handler(imgs)
+
+
+MODELS: Dict[str, ModelSpec] = {}
+
+
+def register_model(name: str, weights: Iterable[LazyYOLO] = (), sessions: bool = False, resets: Iterable[str] = ()):
+    def decorator(fn: Callable[[np.ndarray], str]):
+        MODELS[name] = ModelSpec(name, fn, weights, sessions, resets)
         return fn
 
     return decorator
 
 
-def get_model_handler(name: str) -> Optional[Callable[[Image.Image], str]]:
+def register_batch_handler(name: str):
+    """Attach a batched variant to an action registered with `register_model`"""
+
+    def decorator(fn: Callable[[List[np.ndarray]], List[str]]):
+        MODELS[name].batch_handler = fn
+        return fn
+
+    return decorator
+
+
+def get_model_handler(name: str) -> Optional[Callable[[np.ndarray], str]]:
     if name not in MODELS:
         return None
-    return MODELS[name]
+    return MODELS[name].handler
 
 
-def prepare_and_get_model_handler(name: str) -> Optional[Callable[[Image.Image], str]]:
+def prepare_and_get_model_handler(name: str) -> Optional[Callable[[np.ndarray], str]]:
     send_camera_config()
 
     return get_model_handler(name)
+
+
+def preload_models(names: Iterable[str]):
+    """Load the weights of the given actions up front instead of on first request"""
+    for name in names:
+        if name not in MODELS:
+            logger.warning(f"Cannot preload unknown action: '{name}'")
+            continue
+        MODELS[name].load()
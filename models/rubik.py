@@ -2,16 +2,21 @@ import logging
 import os
 import warnings
 
-import torch
-from ultralytics import YOLO
-from .registry import register_model
-from PIL import Image
+from .registry import register_model, LazyYOLO, Rejected
+from . import rubik_tables
+from .rubik_solutions import SolutionCache
+from .rubik_multistart import MultiStartSolver
+from .rubik_colors import StickerClassifier
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import cv2
 import numpy as np
-import models_files.rubik.solver as solver
-from models_files.rubik.scan_handling import CubeState
 
 from logger import logger
+from sessions import DEFAULT_SESSION, SessionStore
+from preprocess import get_pipeline
+import metrics
+import config
 
 
 # Constants
@@ -26,9 +31,7 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 logging.getLogger("ultralytics").setLevel(logging.ERROR)
 
 
-device_str = "cuda:0" if torch.cuda.is_available() else "cpu"
-model = YOLO("../models_files/rubik.pt", verbose=False)
-model.model.to(device_str)
+model = LazyYOLO("rubik.pt", device="auto", verbose=False)
 
 
 CONF_THRESH = 0.25
@@ -44,6 +47,13 @@ color_mapping = {
     "black":  (0,   0,   0),
 }
 
+def new_classifier() -> StickerClassifier:
+    return StickerClassifier({name: bgr for name, bgr in color_mapping.items() if name != "black"})
+
+# Where each session's cube face is in the frame and what its colours look like.
+# Kept across rubikReset, since the camera and lighting stay the same.
+stickers = SessionStore("rubikFast", new_classifier, config.SESSION_TTL, config.SESSION_MAX)
+
 def order_points(pts):
     rect = np.zeros((4, 2), dtype="float32")
     s = pts.sum(axis=1)
@@ -84,38 +94,63 @@ def assign_to_grid(detections, M, S):
             result.append(grid[r][c] or "black")
     return result
 
-def process_frame(pil_img: Image.Image) -> list[str]:
+def process_frame(bgr: np.ndarray, session: str = DEFAULT_SESSION) -> list[str]:
     """
-    Given a Pillow image and a loaded YOLO model, returns a list of 9
+    Given a BGR image and a loaded YOLO model, returns a list of 9
     color-label strings for the cube face (row-major), defaulting to
     'black' if a cell isn't detected or if there are <4 detections.
+    Complete faces calibrate the session's sticker classifier; with
+    RUBIK_COLOR_FALLBACK, missed cells are classified from their pixels.
     """
-    # 1) convert PIL→OpenCV BGR
-    rgb = np.array(pil_img)
-    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
-
-    # 2) run detection
-    results = model.predict(bgr, conf=conf, verbose=False)
-    if not results or len(results[0].boxes) == 0:
-        return ["black"] * 9
+    # 1) run detection
+    with metrics.timed("rubik", "preprocess"):
+        bgr = get_pipeline("rubik").run(bgr)
+    with metrics.timed("rubik", "inference"):
+        results = model.predict(bgr, conf=conf, verbose=False)
 
-    # 3) extract center points + labels
+    # 2) extract center points + labels
     dets = []
-    names = results[0].names
-    for box in results[0].boxes:
-        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-        cx = float((x1 + x2) / 2)
-        cy = float((y1 + y2) / 2)
-        lbl = names[int(box.cls)]
-        dets.append((cx, cy, lbl))
-
-    # 4) if enough for a perspective transform, compute grid
+    if results:
+        names = results[0].names
+        for box in results[0].boxes:
+            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+            cx = float((x1 + x2) / 2)
+            cy = float((y1 + y2) / 2)
+            lbl = names[int(box.cls)]
+            dets.append((cx, cy, lbl))
+
+    # 3) if enough for a perspective transform, compute grid
+    colors = ["black"] * 9
     if len(dets) >= 4:
-        M, S = rectify_face(dets)
-        return assign_to_grid(dets, M, S)
+        with metrics.timed("rubik", "postprocess"):
+            M, S = rectify_face(dets)
+            colors = assign_to_grid(dets, M, S)
+
+    # 4) fill in missed cells from where the session's last complete face was
+    classifier = stickers.get(session)
+    with classifier.lock:
+        if "black" not in colors:
+            # Only a face with every cell labelled is trusted to locate the cells
+            # (the rectification of a partial face can be off by a cell)
+            classifier.locate(dets, M, S)
+            classifier.calibrate(bgr, colors)
+        elif config.RUBIK_COLOR_FALLBACK and classifier.located:
+            metrics.inc("rubik_color_fallbacks", colors.count("black"), action="rubik")
+            guessed = classifier.classify(bgr)
+            colors = [g if c == "black" else c for c, g in zip(colors, guessed)]
+    return colors
 
-    # 5) otherwise all black
-    return ["black"] * 9
+def fast_frame(bgr: np.ndarray, session: str = DEFAULT_SESSION) -> list[str]:
+    """Classify the 9 stickers from their pixels, or with YOLO until the session is calibrated"""
+    classifier = stickers.get(session)
+    with classifier.lock:
+        if classifier.ready:
+            with metrics.timed("rubikFast", "preprocess"):
+                bgr = get_pipeline("rubik").run(bgr)
+            with metrics.timed("rubikFast", "inference"):
+                return classifier.classify(bgr)
+    metrics.inc("rubik_fast_fallbacks", action="rubikFast")
+    return process_frame(bgr, session)
     
 movements_map = {
     'U': 1,
@@ -125,63 +160,200 @@ movements_map = {
     'L': 5
 }
 
-scans = []
-@register_model("rubik")
-def main(img: Image.Image) -> str:
+def load_solver():
+    # The solver builds or loads its move and pruning tables on import
+    import models_files.rubik.solver as solver
+    
+    if config.RUBIK_MMAP_TABLES:
+        try:
+            rubik_tables.install()
+        except Exception as e:
+            logger.warning(f"Keeping the solver's own tables, memory-mapping failed: {e}")
+    return solver
+
+# Solves from several cube orientations in parallel, when enabled
+multistart = MultiStartSolver(config.RUBIK_SOLVE_PROCESSES, config.RUBIK_SOLVE_STARTS)
+
+# Solutions of cube states seen before, shared by all scans and kept across restarts
+solutions = SolutionCache(config.RUBIK_SOLUTION_CACHE, config.RUBIK_SOLUTION_CACHE_SIZE)
+
+# Scans the robot takes of one cube before it can be solved
+SCAN_COUNT = 11
+FACES = "URFDLB"
+SCAN_COLORS = set(color_mapping) - {"black"}
+
+def validate_cubestring(cubestring: str):
+    """Check the assembled facelets before handing them to the solver"""
+    if len(cubestring) != 54:
+        raise Rejected(f"Cube state has {len(cubestring)} facelets instead of 54: {cubestring}")
+    counts = {face: cubestring.count(face) for face in FACES}
+    if any(count != 9 for count in counts.values()):
+        raise Rejected(f"Cube state does not have 9 facelets of each colour: {counts}")
+    centres = cubestring[4::9]
+    if centres != FACES:
+        raise Rejected(f"Cube state centres are {centres} instead of {FACES}")
+
+def warm_up_solver():
+    """Import the solver and its tables while the remaining scans come in"""
+    try:
+        load_solver()
+        import models_files.rubik.scan_handling  # noqa: F401
+    except Exception as e:
+        logger.warning(f"Could not load the Rubik's solver ahead of time: {e}")
+
+class ScanSequence:
+    """The scans of one cube (one session), checked as they arrive.
+    
+    A scan with undetected stickers is rejected (and can be retaken) instead
+    of corrupting the cube state, and scans beyond SCAN_COUNT are refused
+    until the sequence is reset. The solver is loaded in the background after
+    the first scan, so solving can start as soon as the last one arrives.
+    """
+    
+    def __init__(self):
+        self.scans = []
+        self.lock = threading.Lock()
+        # Background solve of the complete sequence, polled with rubikResult
+        self.solve_future = None
+    
+    def __len__(self):
+        return len(self.scans)
+    
+    @property
+    def complete(self) -> bool:
+        return len(self.scans) == SCAN_COUNT
+    
+    def add(self, colors: list[str]) -> str:
+        """Add the 9 colour names of a scan and return it as a string of first letters"""
+        if len(colors) != CELL_COUNT * CELL_COUNT:
+            raise Rejected(f"Scan has {len(colors)} cells instead of {CELL_COUNT * CELL_COUNT}")
+        # "black" is an undetected sticker; checked before the first letters are
+        # taken, since black and blue would both become "b"
+        missing = [i for i, color in enumerate(colors) if color not in SCAN_COLORS]
+        if missing:
+            raise Rejected(f"Scan {len(self.scans) + 1} is missing stickers at cells {missing}, retake it")
+        if len(self.scans) >= SCAN_COUNT:
+            raise Rejected(f"Already have {SCAN_COUNT} scans, reset with rubikReset first")
+        
+        scan = "".join(color[0] for color in colors)
+        self.scans.append([scan])
+        logger.info("Scan " + str(len(self.scans)) +" completed: " + scan)
+        if len(self.scans) == 1:
+            threading.Thread(target=warm_up_solver, name="rubik-warm-up", daemon=True).start()
+        return scan
+    
+    def cubestring(self) -> str:
+        from models_files.rubik.scan_handling import CubeState
+        
+        cube = CubeState(self.scans)
+        cube.process_scans()
+        cubestring = cube.get_cube_state()
+        validate_cubestring(cubestring)
+        return cubestring
+
+# One scan sequence per session, so a single server can serve several cube robots
+cubes = SessionStore("rubik", ScanSequence, config.SESSION_TTL, config.SESSION_MAX)
+
+@register_model("rubik", weights=[model], sessions=True)
+def main(img: np.ndarray, session: str = DEFAULT_SESSION) -> str:
     # Save the input image exactly as received
-    # fileName = "Scan-" + str(len(scans)) + ".png"
-    # img.save(fileName)
+    # fileName = "Scan-" + str(len(cubes.get(session))) + ".png"
+    # cv2.imwrite(fileName, img)
     
     
     # Process frame
-    colors = process_frame(img)
-    colors = [color[0] for color in colors]
+    colors = process_frame(img, session)
     logger.info("Image processing completed")
+    return add_scan(colors, session)
+
+@register_model("rubikFast", weights=[model], sessions=True)
+def main_fast(img: np.ndarray, session: str = DEFAULT_SESSION) -> str:
+    """Same as `rubik`, without YOLO once the session's colours are calibrated"""
+    colors = fast_frame(img, session)
+    return add_scan(colors, session)
+
+def add_scan(colors: list[str], session: str) -> str:
+    """Add a scan to the session's sequence, and solve the cube after the last one"""
+    sequence = cubes.get(session)
+    with sequence.lock:
+        scan = sequence.add(colors)
+        if not sequence.complete:
+            return scan
+        
+        # Process and solve cube
+        try:
+            cubestring = sequence.cubestring()
+        except Exception as e:
+            # Drop the last scan so it can be retaken; otherwise the full
+            # sequence would refuse every scan until a reset
+            sequence.scans.pop()
+            if isinstance(e, Rejected):
+                raise Rejected(f"{e}; scan {SCAN_COUNT} was dropped, retake it or reset with rubikReset") from e
+            raise
     
-    if colors:
-        # Process detected colors
-        scan = ""
-
-        for i in range(CELL_COUNT):
-            row = "".join(colors[i*CELL_COUNT:(i+1)*CELL_COUNT])
-            # logger.info(f"row: {row}")
-            scan += row
-        scans.append([scan])
-        logger.info("Scan " + str(len(scans)) +"completed: " + scan)
-
-                    
-    # Process and solve cube
-    if len(scans) == 11:
-        cube = CubeState(scans)
-        cube.process_scans()
-        cubestring = cube.get_cube_state()
-        print(cubestring)
-        color_map = {
-            'B': 'W',
-            'F': 'Y',
-            'R': 'G',
-            'L': 'B',
-            'D': 'R',
-            'U': 'O'
-        }
-        final_string = "".join([color_map[c] for c in cubestring])
-        print(final_string)
-        sol = solver.solve(cubestring, 20, 5)
+    print(cubestring)
+    color_map = {
+        'B': 'W',
+        'F': 'Y',
+        'R': 'G',
+        'L': 'B',
+        'D': 'R',
+        'U': 'O'
+    }
+    final_string = "".join([color_map[c] for c in cubestring])
+    print(final_string)
+    
+    if config.RUBIK_BACKGROUND_SOLVE:
+        # The client polls rubikResult for the solution
+        start_solve(sequence, cubestring)
+        return "pending"
+    return solve_cube(cubestring)
+
+def solve_cube(cubestring: str) -> str:
+    """Solve a cube state (from cache if it was solved before) and return the moves"""
+    sol = solutions.get(cubestring)
+    cached = sol is not None
+    if cached:
+        metrics.inc("rubik_solution_cache_hits", action="rubik")
+    else:
+        with metrics.timed("rubik", "solve"):
+            if config.RUBIK_SOLVE_PROCESSES > 0:
+                sol = multistart.solve(cubestring, 20, 5)
+            else:
+                sol = load_solver().solve(cubestring, 20, 5)
         if sol.startswith("Error"):
             raise ValueError("Error in solving the cube: " + sol)
-        
-        moves = sol.split(" ")
-        moves = moves[:-1]  # remove the last item
-        sol = ','.join([str(movements_map[move[0]]) + move[1] for move in moves])
-        
-        logger.info("Result: " + sol)
-        return sol
-    else:
-        return "".join(scan)
     
-@register_model("rubikReset")
-def reset_rubik(img: Image.Image) -> str:
-    global scans
-    scans = []
-    logger.info("Rubik's cube reset")
+    moves = sol.split(" ")
+    moves = moves[:-1]  # remove the last item
+    result = ','.join([str(movements_map[move[0]]) + move[1] for move in moves])
+    # Only solutions the robot can run are kept, so a bad one is never replayed
+    if not cached:
+        solutions.put(cubestring, sol)
+    
+    logger.info("Result: " + result)
+    return result
+
+# Background solves run one at a time; each session polls its own with rubikResult
+solve_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rubik-solve")
+
+def start_solve(sequence: ScanSequence, cubestring: str):
+    sequence.solve_future = solve_executor.submit(solve_cube, cubestring)
+
+@register_model("rubikResult", sessions=True)
+def rubik_result(img: np.ndarray, session: str = DEFAULT_SESSION) -> str:
+    """The solution of the session's background solve, or "pending" while it runs"""
+    solve_future = cubes.get(session).solve_future
+    if solve_future is None:
+        raise Rejected("No solve has been started")
+    if not solve_future.done():
+        return "pending"
+    # Re-raises the solver error, if any
+    return solve_future.result()
+    
+@register_model("rubikReset", sessions=True)
+def reset_rubik(img: np.ndarray, session: str = DEFAULT_SESSION) -> str:
+    """Forget the session's scans so a new cube can be scanned"""
+    cubes.drop(session)
+    logger.info(f"Rubik's cube reset (session {session})")
     return "1"
\ No newline at end of file
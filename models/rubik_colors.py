@@ -0,0 +1,109 @@
+"""Sticker colours of a Rubik's face from the pixels at the cell centres, without YOLO.
+
+Each YOLO scan with enough detections to rectify the face tells
+`StickerClassifier` where the 9 cell centres are in the frame. A frame is then
+classified by taking the median colour of a small patch at each centre and
+picking the nearest palette colour in Lab. The palette starts from the nominal
+colours and follows the session's YOLO-labelled stickers, so it adapts to the
+camera's white balance and lighting.
+"""
+
+from threading import Lock
+
+import cv2
+import numpy as np
+
+CELL_COUNT = 3
+# Weight of a new YOLO-labelled sticker in its colour's running mean
+CALIBRATION_RATE = 0.2
+# Side of the sampled patch as a fraction of the cell spacing
+PATCH_FRACTION = 0.3
+# Lightness varies with shading more than the colour does
+LAB_WEIGHTS = np.array([0.5, 1.0, 1.0], dtype=np.float32)
+
+
+def to_lab(bgr) -> np.ndarray:
+    """Lab values of an (n, 3) array of BGR colours"""
+    pixels = np.asarray(bgr, dtype=np.uint8).reshape(-1, 1, 3)
+    return cv2.cvtColor(pixels, cv2.COLOR_BGR2LAB).reshape(-1, 3).astype(np.float32)
+
+
+def cell_centres(detections, M: np.ndarray, S: int):
+    """Frame coordinates of the 9 cell centres (row-major) and the cell spacing.
+
+    The stickers found are mapped to the rectified face and each axis is fit as
+    offset + spacing * cell index, so missing stickers do not shift the grid.
+    """
+    points = np.array([(x, y) for x, y, label in detections if label != "Face"], dtype=np.float32)
+    axes = []
+    for k in range(2):
+        # Nominal thirds of the face when the stickers do not span two cells
+        spacing, offset = S / CELL_COUNT, S / (2 * CELL_COUNT)
+        if len(points):
+            rectified = cv2.perspectiveTransform(points.reshape(-1, 1, 2), M).reshape(-1, 2)
+            cells = np.minimum(CELL_COUNT - 1, (rectified[:, k] / (S / CELL_COUNT)).astype(int))
+            if len(np.unique(cells)) >= 2:
+                spacing, offset = np.polyfit(cells, rectified[:, k], 1)
+        axes.append(offset + spacing * np.arange(CELL_COUNT))
+
+    xs, ys = np.meshgrid(axes[0], axes[1])
+    grid = np.stack([xs.ravel(), ys.ravel()], axis=1).astype(np.float32)
+    centres = cv2.perspectiveTransform(grid.reshape(-1, 1, 2), np.linalg.inv(M)).reshape(-1, 2)
+    spacing = min(abs(axes[0][1] - axes[0][0]), abs(axes[1][1] - axes[1][0]))
+    return centres, spacing
+
+
+def sample_cells(frame: np.ndarray, centres: np.ndarray, radius: int) -> np.ndarray:
+    """Median BGR colour of the square patch around each centre, shape (n, 3)"""
+    h, w = frame.shape[:2]
+    offsets = np.arange(-radius, radius + 1)
+    xs = np.clip(np.rint(centres[:, 0]).astype(int)[:, None] + offsets, 0, w - 1)
+    ys = np.clip(np.rint(centres[:, 1]).astype(int)[:, None] + offsets, 0, h - 1)
+    patches = frame[ys[:, :, None], xs[:, None, :]]
+    return np.median(patches.reshape(len(centres), -1, 3), axis=1)
+
+
+class StickerClassifier:
+    """Cell positions and colour palette of one session's cube.
+
+    Not thread-safe on its own; callers hold `lock`.
+    """
+
+    def __init__(self, colors: dict):
+        self.names = list(colors)
+        self.palette = to_lab(list(colors.values()))
+        self.calibrated = np.zeros(len(self.names), dtype=bool)
+        self.centres = None
+        self.radius = 1
+        self.lock = Lock()
+
+    @property
+    def located(self) -> bool:
+        return self.centres is not None
+
+    @property
+    def ready(self) -> bool:
+        """Whether every colour has been seen in a YOLO scan"""
+        return self.located and bool(self.calibrated.all())
+
+    def locate(self, detections, M: np.ndarray, S: int):
+        self.centres, spacing = cell_centres(detections, M, S)
+        self.radius = max(1, int(spacing * PATCH_FRACTION / 2))
+
+    def calibrate(self, frame: np.ndarray, labels: list[str]):
+        """Move the palette towards the colours of the cells YOLO labelled"""
+        samples = to_lab(sample_cells(frame, self.centres, self.radius))
+        for sample, label in zip(samples, labels):
+            if label not in self.names:
+                continue
+            i = self.names.index(label)
+            # The first sample replaces the nominal colour
+            rate = CALIBRATION_RATE if self.calibrated[i] else 1.0
+            self.palette[i] += rate * (sample - self.palette[i])
+            self.calibrated[i] = True
+
+    def classify(self, frame: np.ndarray) -> list[str]:
+        """Colour names of the 9 cells (row-major)"""
+        samples = to_lab(sample_cells(frame, self.centres, self.radius))
+        distances = (((samples[:, None, :] - self.palette[None, :, :]) * LAB_WEIGHTS) ** 2).sum(axis=2)
+        return [self.names[i] for i in distances.argmin(axis=1)]
@@ -0,0 +1,250 @@
+"""Multi-start Rubik's solving: the same cube solved from several orientations at once.
+
+The two-phase solver's solution length depends on how the cube is held. A
+whole-cube rotation turns a facelet string into an equivalent one (stickers
+move, and faces are renamed after their new centres). Solving it and renaming
+the faces of the moves back gives a valid solution for the original cube.
+The robot has no motor on the B face, so only the rotations about the F-B
+axis are used: every other one would turn some solver move into a B move.
+
+`solve` runs one orientation per task on a process pool. Each task keeps
+asking the solver for something strictly shorter than the shortest length
+found so far by any orientation, until the time budget runs out. That length
+is shared through a slot of a `multiprocessing.Array`, one slot per solve in
+progress, so solves of different sessions run side by side.
+"""
+
+import itertools
+import multiprocessing as mp
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+import numpy as np
+
+from logger import logger
+
+FACES = "URFDLB"
+# Solves that can run at once, each with its own best length
+SLOTS = 16
+# Seconds for the first search of a task that starts after its solve's deadline
+FIRST_SEARCH_TIMEOUT = 0.5
+
+# Outward normal of each face; x to the right (R), y up (U), z to the front (F)
+NORMALS = {
+    "U": (0, 1, 0),
+    "R": (1, 0, 0),
+    "F": (0, 0, 1),
+    "D": (0, -1, 0),
+    "L": (-1, 0, 0),
+    "B": (0, 0, -1),
+}
+
+
+def facelet_position(face: str, row: int, col: int):
+    """Cubie position of a sticker, as laid out in the solver's facelet string"""
+    if face == "U":
+        return (col - 1, 1, row - 1)
+    if face == "R":
+        return (1, 1 - row, 1 - col)
+    if face == "F":
+        return (col - 1, 1 - row, 1)
+    if face == "D":
+        return (col - 1, -1, 1 - row)
+    if face == "L":
+        return (-1, 1 - row, col - 1)
+    return (1 - col, 1 - row, -1)
+
+
+def _facelets():
+    facelets = []
+    for face in FACES:
+        for row in range(3):
+            for col in range(3):
+                facelets.append((facelet_position(face, row, col), NORMALS[face]))
+    return np.array([p for p, _ in facelets]), np.array([n for _, n in facelets])
+
+
+POSITIONS, FACELET_NORMALS = _facelets()
+
+
+def rotations():
+    """The 24 rotation matrices of the cube, identity first"""
+    result = []
+    for perm in itertools.permutations(range(3)):
+        for signs in itertools.product((1, -1), repeat=3):
+            m = np.zeros((3, 3), dtype=int)
+            for i, (j, sign) in enumerate(zip(perm, signs)):
+                m[i, j] = sign
+            if round(np.linalg.det(m)) == 1:
+                result.append(m)
+    result.sort(key=lambda m: not np.array_equal(m, np.eye(3, dtype=int)))
+    return result
+
+
+class Orientation:
+    """A whole-cube rotation as a facelet permutation plus a face renaming"""
+
+    def __init__(self, rotation):
+        index = {
+            (tuple(p), tuple(n)): i
+            for i, (p, n) in enumerate(zip(POSITIONS, FACELET_NORMALS))
+        }
+        # Sticker i moves to facelet `target[i]`
+        self.target = np.array([
+            index[(tuple(rotation @ p), tuple(rotation @ n))]
+            for p, n in zip(POSITIONS, FACELET_NORMALS)
+        ])
+        normal_face = {v: k for k, v in NORMALS.items()}
+        # Face (and centre colour) `f` ends up where face `rename[f]` is
+        self.rename = {f: normal_face[tuple(rotation @ np.array(NORMALS[f]))] for f in FACES}
+        self.restore = {v: k for k, v in self.rename.items()}
+
+    def apply(self, cubestring: str) -> str:
+        rotated = [""] * 54
+        for i, letter in enumerate(cubestring):
+            rotated[self.target[i]] = self.rename[letter]
+        return "".join(rotated)
+
+    def unapply_moves(self, solution: str) -> str:
+        """Rename the faces of the rotated cube's solution back to the original cube's"""
+        moves = []
+        for move in solution.split():
+            if move.startswith("("):
+                moves.append(move)
+            else:
+                moves.append(self.restore[move[0]] + move[1:])
+        return " ".join(moves)
+
+
+# Faces the robot can turn
+MOTOR_FACES = "URFDL"
+
+# The 4 rotations that keep B on B (identity first)
+ORIENTATIONS = [o for o in (Orientation(r) for r in rotations()) if o.rename["B"] == "B"]
+
+
+def solution_length(solution: str) -> int:
+    return sum(1 for move in solution.split() if not move.startswith("("))
+
+
+# Set in each pool process by `init_worker`
+_best = None
+
+
+def init_worker(best):
+    global _best
+    _best = best
+    # Load the solver (and its shared tables) once per process, not per task
+    from .rubik import load_solver
+
+    load_solver()
+
+
+def solve_orientation(cubestring: str, orientation: int, max_length: int, deadline: float, slot: int):
+    """Shortest solution of one orientation found before `deadline` (a `time.time()`)"""
+    from .rubik import load_solver
+
+    solver = load_solver()
+    o = ORIENTATIONS[orientation]
+    rotated = o.apply(cubestring)
+    best = None
+    while True:
+        # Only look for solutions shorter than the best one of any orientation
+        target = min(max_length, _best[slot] - 1)
+        remaining = deadline - time.time()
+        if target < 1 or (remaining <= 0 and best is not None):
+            return best
+
+        # A task that only started after the deadline (queued behind other
+        # solves) still gets one short search, which is usually enough for a
+        # first solution
+        solution = solver.solve(rotated, target, max(remaining, FIRST_SEARCH_TIMEOUT))
+        if solution.startswith("Error"):
+            return best
+
+        length = solution_length(solution)
+        with _best.get_lock():
+            if length < _best[slot]:
+                _best[slot] = length
+        best = o.unapply_moves(solution)
+
+
+class MultiStartSolver:
+    def __init__(self, processes: int, starts: int):
+        self.processes = processes
+        self.starts = min(starts, len(ORIENTATIONS))
+        self._pool = None
+        self._best = None
+        self._lock = Lock()
+        self._slots = queue.Queue()
+        for slot in range(SLOTS):
+            self._slots.put(slot)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                ctx = mp.get_context("spawn")
+                # Shared with the pool processes, which cannot be passed a Value per task
+                self._best = ctx.Array("i", SLOTS)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=ctx,
+                    initializer=init_worker,
+                    initargs=(self._best,),
+                )
+            return self._pool
+
+    def _reset_pool(self, pool):
+        # A crashed pool cannot take new tasks; the next solve starts a fresh one
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def solve(self, cubestring: str, max_length: int, timeout: float) -> str:
+        """Shortest solution over the orientations found within `timeout` seconds"""
+        pool = self._get_pool()
+        # The orientations of this solve share one slot's best length
+        slot = self._slots.get()
+        try:
+            self._best[slot] = max_length + 1
+            deadline = time.time() + timeout
+            try:
+                futures = [
+                    pool.submit(solve_orientation, cubestring, i, max_length, deadline, slot)
+                    for i in range(self.starts)
+                ]
+            except BrokenProcessPool:
+                futures = []
+            # Starts still queued when the budget runs out return at once
+            done, pending = wait(futures, timeout=timeout + 1)
+            for future in pending:
+                future.cancel()
+        finally:
+            self._slots.put(slot)
+        if not futures:
+            self._reset_pool(pool)
+
+        solutions = []
+        for future in done:
+            try:
+                solution = future.result()
+                # Never hand the robot a move it has no motor for
+                if solution is not None and all(
+                    move[0] in MOTOR_FACES for move in solution.split() if not move.startswith("(")
+                ):
+                    solutions.append(solution)
+            except BrokenProcessPool as e:
+                logger.warning(f"Multi-start solve failed: {e}")
+                self._reset_pool(pool)
+            except Exception as e:
+                logger.warning(f"Multi-start solve failed: {e}")
+        if not solutions:
+            return "Error: no solution found by any orientation"
+
+        best = min(solutions, key=solution_length)
+        logger.info(f"Best of {len(solutions)} orientations: {solution_length(best)} moves")
+        return best
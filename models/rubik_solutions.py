@@ -0,0 +1,71 @@
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from logger import logger
+
+
+def canonical_cubestring(cubestring: str) -> str:
+    """Facelet string in the solver's URFDLB order, without whitespace"""
+    return "".join(cubestring.split()).upper()
+
+
+class SolutionCache:
+    """Solver results by cube state, kept in a JSON file across restarts.
+
+    Holds at most `max_entries` states and drops the least recently used one
+    beyond that. The file is rewritten atomically after every new solution.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = None
+        self._lock = Lock()
+
+    def _load(self):
+        # Called with the lock held
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable solution cache {self.path}: {e}")
+            return
+        # Stored least recently used first
+        for cubestring, solution in entries[-self.max_entries :]:
+            self._entries[cubestring] = solution
+
+    def get(self, cubestring: str):
+        key = canonical_cubestring(cubestring)
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, cubestring: str, solution: str):
+        key = canonical_cubestring(cubestring)
+        with self._lock:
+            self._load()
+            self._entries[key] = solution
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save solution cache {self.path}: {e}")
@@ -0,0 +1,189 @@
+"""Memory-mapped copies of the Rubik's solver's move, pruning and symmetry tables.
+
+The two-phase solver in models_files/rubik keeps its tables as module-level
+`array.array`s, so every process that imports it holds a private copy. After
+the solver is imported, `install()` writes each large table once to a
+versioned file under models_files/rubik/mmap and replaces the module global
+with a read-only view of that file mapped with `mmap`. The OS page cache then
+backs the tables of every worker process with the same pages. Each file
+records a stamp of the solver's files (names, sizes and modification times)
+and is rewritten when they change; checking it costs a `stat` per file rather
+than a hash of every table.
+
+This lowers the steady-state memory of each process and shares the pages
+between workers. It does not shorten startup or lower the peak: the solver
+still builds or loads its own tables when it is imported, before `install()`.
+
+Generate the files ahead of time with `python -m models.rubik_tables`.
+"""
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process
+    fcntl = None
+
+from logger import logger
+from .registry import WEIGHTS_DIR
+
+MAGIC = b"RBKT"
+VERSION = 2
+# magic, format version, typecode, item size, item count, stamp of the solver files
+HEADER = struct.Struct("<4sHcBQ8s")
+# Data starts at a 64-byte boundary
+HEADER_SIZE = 64
+
+SOLVER_DIR = os.path.join(WEIGHTS_DIR, "rubik")
+TABLES_DIR = os.path.join(SOLVER_DIR, "mmap")
+# Written next to the solver, but not part of it
+STAMP_IGNORED = {"solutions.json"}
+SOLVER_PACKAGE = "models_files.rubik"
+# Small arrays are not worth a file of their own
+MIN_ITEMS = 4096
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def table_path(module: str, name: str) -> str:
+    return os.path.join(TABLES_DIR, f"{module.rsplit('.', 1)[-1]}.{name}.tbl")
+
+
+def solver_stamp() -> bytes:
+    """Digest of the names, sizes and modification times of the solver's files"""
+    h = hashlib.blake2b(digest_size=8)
+    if os.path.isdir(SOLVER_DIR):
+        for entry in sorted(os.scandir(SOLVER_DIR), key=lambda e: e.name):
+            if entry.is_file() and entry.name not in STAMP_IGNORED:
+                st = entry.stat()
+                h.update(f"{entry.name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.digest()
+
+
+@contextmanager
+def writer_lock():
+    """Held while checking and writing tables, across processes where possible"""
+    os.makedirs(TABLES_DIR, exist_ok=True)
+    with open(os.path.join(TABLES_DIR, ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_table(path: str, table: array.array, stamp: bytes):
+    header = HEADER.pack(MAGIC, VERSION, table.typecode.encode(), table.itemsize, len(table), stamp)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A name of its own, so concurrent writers never write into the same file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        table.tofile(f)
+    # Readers never see a half-written table
+    os.replace(tmp, path)
+
+
+def read_header(path: str):
+    with open(path, "rb") as f:
+        return HEADER.unpack(f.read(HEADER.size))
+
+
+def is_current(path: str, table: array.array, stamp: bytes) -> bool:
+    if not os.path.exists(path):
+        return False
+    try:
+        magic, version, typecode, itemsize, count, stored = read_header(path)
+    except struct.error:
+        return False
+    return (
+        magic == MAGIC
+        and version == VERSION
+        and typecode.decode() == table.typecode
+        and itemsize == table.itemsize
+        and count == len(table)
+        and stored == stamp
+        and os.path.getsize(path) == HEADER_SIZE + itemsize * count
+    )
+
+
+def open_table(path: str) -> memoryview:
+    """Map a table file read-only and return its items as a typed memoryview"""
+    magic, version, typecode, itemsize, count, _ = read_header(path)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} table")
+    with open(path, "rb") as f:
+        # The mapping stays valid after the file is closed
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)[HEADER_SIZE : HEADER_SIZE + itemsize * count].cast(typecode.decode())
+    if view.itemsize != itemsize:
+        raise ValueError(f"{path} was written with item size {itemsize}, this platform uses {view.itemsize}")
+    return view
+
+
+def solver_modules():
+    return [
+        module for name, module in list(sys.modules.items())
+        if name.startswith(f"{SOLVER_PACKAGE}.") and module is not None
+    ]
+
+
+def install() -> int:
+    """Swap the imported solver modules' tables for memory-mapped views.
+
+    Returns the number of bytes now served from the mapped files.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return 0
+
+        modules = solver_modules()
+        stamp = solver_stamp()
+        tables = {}
+        for module in modules:
+            for name, value in list(vars(module).items()):
+                if isinstance(value, array.array) and len(value) >= MIN_ITEMS and id(value) not in tables:
+                    tables[id(value)] = (value, table_path(module.__name__, name))
+
+        stale = [(value, path) for value, path in tables.values() if not is_current(path, value, stamp)]
+        if stale:
+            # Other processes (pool workers, `python -m models.rubik_tables`) may be
+            # writing the same tables; the first one to get the lock does it
+            with writer_lock():
+                for value, path in stale:
+                    if not is_current(path, value, stamp):
+                        logger.info(f"Writing solver table {path}")
+                        write_table(path, value, stamp)
+        replaced = {key: (value, open_table(path)) for key, (value, path) in tables.items()}
+
+        # Replace every reference, including ones imported into other solver modules
+        for module in modules:
+            for name, value in list(vars(module).items()):
+                if id(value) in replaced and replaced[id(value)][0] is value:
+                    setattr(module, name, replaced[id(value)][1])
+
+        _installed = True
+    size = sum(view.nbytes for _, view in replaced.values())
+    logger.info(f"Memory-mapped {len(replaced)} solver tables ({size / 2**20:.1f} MiB)")
+    return size
+
+
+def main():
+    import models_files.rubik.solver  # noqa: F401 - builds or loads the tables
+
+    install()
+
+
+if __name__ == "__main__":
+    main()
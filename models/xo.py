@@ -1,13 +1,16 @@
-from .registry import register_model
-from PIL import Image
+from .registry import register_model, register_batch_handler, LazyYOLO
+from .xo_engine import PLAYERS, table
+from threading import Lock
 import cv2
 import numpy as np
-import torch
-from ultralytics import YOLO
 import warnings
 import os
 import logging
 from logger import logger
+from preprocess import get_pipeline
+from sessions import DEFAULT_SESSION, SessionStore
+import metrics
+import config
 
 warnings.filterwarnings("ignore")
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
@@ -17,79 +20,67 @@ cv2.setLogLevel(0)
 logging.getLogger("ultralytics").setLevel(logging.ERROR)
 
 
-device_str = "cuda:0" if torch.cuda.is_available() else "cpu"
-base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-model_path = os.path.join(base_dir, "models_files", "xo.pt")
+# Weights are loaded on the first request (or at startup via PRELOAD_MODELS)
+model = LazyYOLO("xo.pt", device="auto", verbose=False)
 
-# Add debug information to help diagnose
-print(f"Looking for model at: {model_path}")
-print(f"Current working directory: {os.getcwd()}")
-print(f"Directory exists: {os.path.exists(os.path.dirname(model_path))}")
 
-# Then load the model with the absolute path
-model = YOLO(model_path, verbose=False)
-model.model.to(device_str)
-print("Model loaded successfully XO.")
+def process_pieces(frame):
+    return process_pieces_batch([frame])[0]
 
 
-def process_pieces(frame):
-    results = model.predict(frame, conf=0.25)
-    detections = []
-    if results and len(results[0].boxes) > 0:
-        for box in results[0].boxes:
+def process_pieces_batch(frames):
+    # One predict call for the whole batch, one result per frame
+    results = model.predict(frames, conf=0.25)
+    batch_detections = []
+    for result in results:
+        detections = []
+        for box in result.boxes:
             x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-            label = results[0].names[int(box.cls)]
+            label = result.names[int(box.cls)]
             if label in ["X", "O"]:
                 detections.append((x1, y1, x2, y2, label))
-    return detections
+        batch_detections.append(detections)
+    return batch_detections
 
 
-def convert_grid_to_cells(grid):
+def group_rows(grid, y_threshold=10):
+    """Deduplicate grid points and group them into rows, sorted top to bottom and
+    left to right"""
+    # Points snapped to the same 5px position are duplicates; a piece replaces
+    # an empty cell found at the same position
+    positions = {}
     deduplicated_grid = []
-    seen_positions = set()
     for x, y, label in grid:
-        pos = (
-            round(x / 5) * 5,
-            round(y / 5) * 5,
-        )
-        if pos not in seen_positions:
-            seen_positions.add(pos)
+        pos = (round(x / 5) * 5, round(y / 5) * 5)
+        i = positions.get(pos)
+        if i is None:
+            positions[pos] = len(deduplicated_grid)
             deduplicated_grid.append((x, y, label))
-        else:
-            for i, (existing_x, existing_y, existing_label) in enumerate(
-                deduplicated_grid
-            ):
-                existing_pos = (round(existing_x / 5) * 5, round(existing_y / 5) * 5)
-                if existing_pos == pos:
-                    if existing_label == "-" and label in ["X", "O"]:
-                        deduplicated_grid[i] = (x, y, label)
-                    break
-
-    sorted_grid = sorted(deduplicated_grid, key=lambda x: (x[1], x[0]))
+        elif deduplicated_grid[i][2] == "-" and label in ["X", "O"]:
+            deduplicated_grid[i] = (x, y, label)
 
+    # Sort by (y, x) and start a new row wherever y jumps by more than the threshold
     rows = []
-    current_row = []
     last_y = None
-    y_threshold = 10
-
-    for x, y, label in sorted_grid:
-        if last_y is None or abs(y - last_y) <= y_threshold:
-            current_row.append((x, y, label))
-        else:
-            current_row.sort(key=lambda x: x[0])
-            row = [item[2] for item in current_row]
-            row.extend(["-"] * (5 - len(row)))
-            rows.append(row[:5])
-            current_row = [(x, y, label)]
-        last_y = y
-
-    if current_row:
-        current_row.sort(key=lambda x: x[0])
-        row = [item[2] for item in current_row]
+    for point in sorted(deduplicated_grid, key=lambda p: (p[1], p[0])):
+        if last_y is None or point[1] - last_y > y_threshold:
+            rows.append([])
+        rows[-1].append(point)
+        last_y = point[1]
+
+    for row in rows:
+        row.sort(key=lambda p: p[0])
+    return rows
+
+
+def pad_rows(rows):
+    """Pad or cut the rows of labels to the 3x5 board layout"""
+    cells = []
+    for row in rows:
+        row = list(row)
         row.extend(["-"] * (5 - len(row)))
-        rows.append(row[:5])
+        cells.append(row[:5])
 
-    cells = rows
     while len(cells) < 3:
         cells.append(["-"] * 5)
     if len(cells) > 3:
@@ -98,23 +89,17 @@ def convert_grid_to_cells(grid):
     return cells
 
 
-def detect_tic_tac_toe(frame):
-    # Resize for faster processing
-    cv_img = cv2.cvtColor(np.array(frame), cv2.COLOR_RGB2BGR)
-    frame = cv2.resize(cv_img, (320, 240))
+def convert_grid_to_cells(grid):
+    rows = group_rows(grid)
+    return pad_rows([[label for _, _, label in row] for row in rows])
 
-    # Crop frame to focus on the game area
-    x1, y1 = 48, 64
-    x2, y2 = 294, 209
-    frame_original = frame.copy()
-    frame = frame[y1:y2, x1:x2]
 
-    # Draw crop boundaries on original frame for visualization
-    cv2.rectangle(frame_original, (x1, y1), (x2, y2), (255, 255, 0), 2)
+def crop_board(frame):
+    # Resize and crop to the game area (see preprocess.py), resampling only the crop
+    return get_pipeline("xo").run(frame)
 
-    # Detect pieces with YOLO
-    detections = process_pieces(frame)
 
+def find_empty_cells(frame):
     # Convert to grayscale
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
@@ -158,6 +143,12 @@ def detect_tic_tac_toe(frame):
                     center_y = int(y + w / 2)
                     grid.append((center_x, center_y, "-"))
 
+    return grid
+
+
+def build_cells(frame, detections, board):
+    grid = find_empty_cells(frame)
+
     # Add detected pieces to grid
     for x1, y1, x2, y2, label in detections:
         center_x = int((x1 + x2) / 2)
@@ -165,13 +156,141 @@ def detect_tic_tac_toe(frame):
         grid.append((center_x, center_y, label))
 
     # Convert grid to cells
-    cells = convert_grid_to_cells(grid)
-    return cells
+    rows = group_rows(grid)
+    board.learn(frame, rows)
+    return pad_rows([[label for _, _, label in row] for row in rows])
+
+
+# Side of the patch each cell is resampled to for the fast engine
+PATCH_SIZE = 16
+# Patches flatter than this (grey level standard deviation) are empty cells
+EMPTY_STD = 12.0
+
+
+def synthetic_templates():
+    """X and O drawn as dark strokes on a light cell, used until real ones are learned"""
+    x = np.full((PATCH_SIZE, PATCH_SIZE), 255, dtype=np.uint8)
+    cv2.line(x, (3, 3), (PATCH_SIZE - 4, PATCH_SIZE - 4), 0, 2)
+    cv2.line(x, (PATCH_SIZE - 4, 3), (3, PATCH_SIZE - 4), 0, 2)
+    o = np.full((PATCH_SIZE, PATCH_SIZE), 255, dtype=np.uint8)
+    cv2.circle(o, (PATCH_SIZE // 2, PATCH_SIZE // 2), PATCH_SIZE // 2 - 3, 0, 2)
+    return {"X": x.astype(np.float32).ravel(), "O": o.astype(np.float32).ravel()}
+
+
+def normalize(vectors):
+    """Zero-mean, unit-length rows, so a dot product is a correlation"""
+    vectors = vectors - vectors.mean(axis=-1, keepdims=True)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+
+class BoardModel:
+    """Cell layout and X/O/empty appearance of the board, learned from the YOLO engine.
+
+    Every time the YOLO engine sees complete rows of cells (3 rows with the
+    same number of cells), the cell centres and a running mean patch per
+    label are updated. The fast engine then only resamples those cells with
+    one `cv2.remap` call and classifies all of them with one matrix product.
+    """
+
+    def __init__(self):
+        self.sums = {}
+        self.counts = {}
+        # (layout, maps, names, matrix), replaced as a whole by `learn` and
+        # read once by `classify`, so it never sees parts of two learns
+        self._snapshot = None
+        self._lock = Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def learn(self, frame, rows):
+        if len(rows) != 3 or len({len(row) for row in rows}) != 1 or len(rows[0]) < 3:
+            return
+
+        centres = np.array([(x, y) for row in rows for x, y, _ in row], dtype=np.float32)
+        labels = [label for row in rows for _, _, label in row]
+        # Cells are spaced about one cell apart, patches cover most of a cell
+        spacing = np.median(np.diff(np.array([[x for x, _, _ in row] for row in rows]), axis=1))
+        maps = patch_maps(centres, 0.8 * spacing)
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        patches = sample_patches(gray, maps)
+        with self._lock:
+            for label, patch in zip(labels, patches):
+                self.sums[label] = self.sums.get(label, 0) + patch
+                self.counts[label] = self.counts.get(label, 0) + 1
+
+            templates = synthetic_templates()
+            templates.update({label: self.sums[label] / self.counts[label] for label in self.sums})
+            names = sorted(templates)
+            matrix = normalize(np.stack([templates[name] for name in names]))
+            self._snapshot = ([len(row) for row in rows], maps, names, matrix)
+
+    def classify(self, frame):
+        """Labels of the board cells in `frame`, as rows"""
+        layout, maps, names, matrix = self._snapshot
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        patches = sample_patches(gray, maps)
+        scores = np.abs(normalize(patches) @ matrix.T)
+        labels = np.array(names)[scores.argmax(axis=1)]
+        labels[patches.std(axis=1) < EMPTY_STD] = "-"
+
+        rows, start = [], 0
+        for length in layout:
+            rows.append(labels[start : start + length].tolist())
+            start += length
+        return rows
+
+
+def patch_maps(centres, size):
+    """remap() coordinates sampling a PATCH_SIZE x PATCH_SIZE patch around each centre,
+    stacked vertically"""
+    offsets = (np.arange(PATCH_SIZE, dtype=np.float32) + 0.5) / PATCH_SIZE * size - size / 2
+    map_x = centres[:, 0, None, None] + offsets[None, None, :]
+    map_y = centres[:, 1, None, None] + offsets[None, :, None]
+    shape = (len(centres) * PATCH_SIZE, PATCH_SIZE)
+    return (
+        np.broadcast_to(map_x, (len(centres), PATCH_SIZE, PATCH_SIZE)).reshape(shape).astype(np.float32),
+        np.broadcast_to(map_y, (len(centres), PATCH_SIZE, PATCH_SIZE)).reshape(shape).astype(np.float32),
+    )
+
 
+def sample_patches(gray, maps):
+    """All cell patches in one remap call, as one flattened row per cell"""
+    patches = cv2.remap(gray, maps[0], maps[1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return patches.reshape(-1, PATCH_SIZE * PATCH_SIZE).astype(np.float32)
 
-@register_model("xo")
-def process_image(img: Image.Image) -> str:
-    result = np.array(detect_tic_tac_toe(img)).flatten().tolist()
+
+# One board per session, so several cameras do not mix up their cell layouts
+boards = SessionStore("xo", BoardModel, config.SESSION_TTL, config.SESSION_MAX)
+
+
+def detect_tic_tac_toe(frame, session=DEFAULT_SESSION):
+    return detect_tic_tac_toe_batch([frame], [session])[0]
+
+
+def detect_tic_tac_toe_batch(frames, sessions):
+    # Before any work, so a refused session leaves the batch's state untouched
+    session_boards = [boards.get(session) for session in sessions]
+    with metrics.timed("xo", "preprocess"):
+        crops = [crop_board(frame) for frame in frames]
+
+    # Detect pieces with YOLO
+    with metrics.timed("xo", "inference"):
+        detections = process_pieces_batch(crops)
+
+    with metrics.timed("xo", "postprocess"):
+        return [
+            build_cells(crop, dets, board)
+            for crop, dets, board in zip(crops, detections, session_boards)
+        ]
+
+
+def format_cells(cells) -> str:
+    result = np.array(cells).flatten().tolist()
 
     m = {"X": 1, "O": 2, "-": 0}
 
@@ -180,3 +299,81 @@ def process_image(img: Image.Image) -> str:
     logger.info(f"Result: {result}")
 
     return result
+
+
+@register_model("xo", weights=[model], sessions=True)
+def process_image(img: np.ndarray, session: str = DEFAULT_SESSION) -> str:
+    return format_cells(detect_tic_tac_toe(img, session))
+
+
+@register_batch_handler("xo")
+def process_images(imgs: list[np.ndarray], sessions: list[str] = None) -> list[str]:
+    sessions = sessions or [DEFAULT_SESSION] * len(imgs)
+    return [format_cells(cells) for cells in detect_tic_tac_toe_batch(imgs, sessions)]
+
+
+def detect_fast_batch(frames, sessions):
+    """Classify the learned cells without YOLO, falling back to it for sessions
+    whose full board has not been seen yet"""
+    session_boards = [boards.get(session) for session in sessions]
+    results = [None] * len(frames)
+
+    slow = [i for i, board in enumerate(session_boards) if not board.ready]
+    if slow:
+        metrics.inc("xo_fast_fallbacks", len(slow), action="xoFast")
+        detected = detect_tic_tac_toe_batch([frames[i] for i in slow], [sessions[i] for i in slow])
+        for i, cells in zip(slow, detected):
+            results[i] = cells
+
+    fast = [i for i in range(len(frames)) if results[i] is None]
+    if fast:
+        with metrics.timed("xoFast", "preprocess"):
+            crops = [crop_board(frames[i]) for i in fast]
+
+        with metrics.timed("xoFast", "inference"):
+            for i, crop in zip(fast, crops):
+                results[i] = pad_rows(session_boards[i].classify(crop))
+    return results
+
+
+@register_model("xoFast", weights=[model], sessions=True)
+def process_image_fast(img: np.ndarray, session: str = DEFAULT_SESSION) -> str:
+    return format_cells(detect_fast_batch([img], [session])[0])
+
+
+@register_batch_handler("xoFast")
+def process_images_fast(imgs: list[np.ndarray], sessions: list[str] = None) -> list[str]:
+    sessions = sessions or [DEFAULT_SESSION] * len(imgs)
+    return [format_cells(cells) for cells in detect_fast_batch(imgs, sessions)]
+
+
+def best_move(cells, player: str) -> int:
+    """Index of `player`'s best move in the flattened 3x5 result, or -1 if there is none"""
+    columns = config.XO_BOARD_COLUMNS
+    m = {"X": 1, "O": 2, "-": 0}
+    board = [m[cells[row][column]] for row in range(3) for column in columns]
+    move = table.best_move(board, PLAYERS[player])
+    if move < 0:
+        return -1
+    row, column = divmod(move, 3)
+    return row * 5 + columns[column]
+
+
+def format_move(cells, player: str) -> str:
+    # The board state as returned by `xo`, followed by the suggested move
+    return f"{format_cells(cells)},{best_move(cells, player)}"
+
+
+def register_move_actions(player: str):
+    @register_model(f"xoMove{player}", weights=[model, table], sessions=True)
+    def process_image_move(img: np.ndarray, session: str = DEFAULT_SESSION) -> str:
+        return format_move(detect_tic_tac_toe(img, session), player)
+
+    @register_batch_handler(f"xoMove{player}")
+    def process_images_move(imgs: list[np.ndarray], sessions: list[str] = None) -> list[str]:
+        sessions = sessions or [DEFAULT_SESSION] * len(imgs)
+        return [format_move(cells, player) for cells in detect_tic_tac_toe_batch(imgs, sessions)]
+
+
+for player in PLAYERS:
+    register_move_actions(player)
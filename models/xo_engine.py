@@ -0,0 +1,129 @@
+from threading import Lock
+import numpy as np
+
+from logger import logger
+
+EMPTY, X, O = 0, 1, 2
+PLAYERS = {"X": X, "O": O}
+
+LINES = [
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),
+    (0, 4, 8), (2, 4, 6),
+]
+
+# The 8 symmetries of the square: symmetric board[i] = board[perm[i]]
+_ROTATE = (6, 3, 0, 7, 4, 1, 8, 5, 2)
+_MIRROR = (2, 1, 0, 5, 4, 3, 8, 7, 6)
+
+
+def _symmetries():
+    perms = [tuple(range(9))]
+    for _ in range(3):
+        perms.append(tuple(perms[-1][i] for i in _ROTATE))
+    perms += [tuple(p[i] for i in _MIRROR) for p in perms]
+    return np.array(perms)
+
+
+SYMMETRIES = _symmetries()
+POWERS = 3 ** np.arange(9)
+
+
+def encode(board) -> int:
+    """Base-3 index of a 3x3 board given row-major as 0 (empty), 1 (X) or 2 (O)"""
+    return int(np.dot(board, POWERS))
+
+
+class MoveTable:
+    """Best move for every 3x3 board and player to move, computed once.
+
+    Boards are reduced to one canonical form per symmetry class, solved with
+    a memoized negamax (wins sooner score higher, losses later score higher)
+    and the best move of each canonical board is stored in a flat array, so a
+    lookup is a few array reads. Registered as weights of the move actions so
+    it is built on first use or at startup with PRELOAD_MODELS.
+    """
+
+    def __init__(self):
+        self.canonical = None
+        self.symmetry = None
+        self.moves = None
+        self._lock = Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.moves is not None
+
+    def load(self):
+        if self.moves is not None:
+            return
+        with self._lock:
+            if self.moves is None:
+                self._build()
+
+    def _build(self):
+        # Every board as a row of 9 digits, and its code under each symmetry
+        codes = np.arange(3 ** 9)
+        boards = codes[:, None] // POWERS % 3
+        symmetric = boards[:, SYMMETRIES] @ POWERS
+        canonical = symmetric.min(axis=1)
+        symmetry = symmetric.argmin(axis=1)
+
+        winner = np.zeros(len(codes), dtype=np.int8)
+        for line in LINES:
+            cells = boards[:, line]
+            won = (cells[:, 0] != EMPTY) & (cells[:, 0] == cells[:, 1]) & (cells[:, 1] == cells[:, 2])
+            winner[won] = cells[won, 0]
+        empties = (boards == EMPTY).sum(axis=1)
+
+        values = {}
+
+        def negamax(code: int, player: int) -> int:
+            """Score of the canonical board `code` for the player to move"""
+            key = (code, player)
+            if key in values:
+                return values[key]
+            if winner[code]:
+                value = (1 + empties[code]) * (1 if winner[code] == player else -1)
+            elif empties[code] == 0:
+                value = 0
+            else:
+                value = max(
+                    -negamax(int(canonical[code + player * POWERS[i]]), X + O - player)
+                    for i in range(9)
+                    if boards[code, i] == EMPTY
+                )
+            values[key] = value
+            return value
+
+        moves = np.full((len(codes), 2), -1, dtype=np.int8)
+        for code in np.unique(canonical):
+            if winner[code] or empties[code] == 0:
+                continue
+            for player in (X, O):
+                best, best_value = -1, None
+                for i in range(9):
+                    if boards[code, i] != EMPTY:
+                        continue
+                    value = -negamax(int(canonical[code + player * POWERS[i]]), X + O - player)
+                    if best_value is None or value > best_value:
+                        best, best_value = i, value
+                moves[code, player - 1] = best
+
+        self.canonical, self.symmetry = canonical, symmetry
+        self.moves = moves
+        logger.info(f"Tic-tac-toe move table built ({len(values)} positions)")
+
+    def best_move(self, board, player: int) -> int:
+        """Index (0-8, row-major) of the best move on `board`, or -1 if the game is over"""
+        self.load()
+        code = encode(board)
+        canonical = self.canonical[code]
+        move = int(self.moves[canonical, player - 1])
+        if move < 0:
+            return -1
+        # The move is in the canonical board's coordinates
+        return int(SYMMETRIES[self.symmetry[code], move])
+
+
+table = MoveTable()
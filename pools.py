@@ -0,0 +1,60 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+import config
+import metrics
+
+
+class Overloaded(Exception):
+    """Raised when an action already has as many requests in flight as it may queue"""
+
+
+class InferencePool:
+    """Bounded worker pool for one action.
+
+    At most `workers` calls run at once and at most `max_queue` more wait for a
+    free worker; anything beyond that is rejected with `Overloaded` instead of
+    piling up behind a slow model.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"infer-{name}")
+        self._pending = 0
+        self._lock = Lock()
+
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    def submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise Overloaded(f"Action '{self.name}' has {self._pending} requests in flight")
+            self._pending += 1
+
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+
+_pools = {}
+_pools_lock = Lock()
+
+metrics.register_gauge(
+    "queue_depth",
+    lambda: [({"action": name, "queue": "pool"}, p.depth) for name, p in list(_pools.items())],
+)
+
+
+def get_pool(name: str) -> InferencePool:
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = InferencePool(name, config.INFERENCE_THREADS, config.INFERENCE_QUEUE)
+        return _pools[name]
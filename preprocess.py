@@ -0,0 +1,135 @@
+"""Declarative per-action preprocessing: region of interest, resize and colour conversion.
+
+Pipelines are lists of steps, e.g. for xo:
+
+    [{"op": "resize", "size": [320, 240]}, {"op": "crop", "box": [48, 64, 294, 209]}]
+
+- `crop`: `box` is `[x1, y1, x2, y2]` in the pixels of the step's input. The
+  result is a view of the input, not a copy.
+- `resize`: `size` is `[width, height]`. When a crop follows, only the cropped
+  region of the input is resized, so the rest of the frame is never resampled.
+- `color`: `code` is an OpenCV conversion name without the `COLOR_` prefix,
+  e.g. `BGR2GRAY`.
+
+DEFAULT_PIPELINES reproduces the hardcoded preprocessing of each model. A JSON
+file at PREPROCESS_CONFIG (`{"action": [steps...]}`) replaces the pipeline of
+the actions it lists.
+"""
+
+import json
+import os
+from threading import Lock
+
+import cv2
+import numpy as np
+
+from logger import logger
+import config
+
+DEFAULT_PIPELINES = {
+    "xo": [
+        {"op": "resize", "size": [320, 240]},
+        {"op": "crop", "box": [48, 64, 294, 209]},
+    ],
+}
+
+OPS = ("crop", "resize", "color")
+
+
+def validate_step(step: dict) -> dict:
+    op = step.get("op")
+    if op not in OPS:
+        raise ValueError(f"Unknown preprocessing op {op!r}, expected one of {OPS}")
+    if op == "crop":
+        x1, y1, x2, y2 = map(int, step["box"])
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"Empty crop box {step['box']}")
+        return {"op": op, "box": (x1, y1, x2, y2)}
+    if op == "resize":
+        width, height = map(int, step["size"])
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Invalid resize size {step['size']}")
+        return {"op": op, "size": (width, height)}
+    return {"op": op, "code": getattr(cv2, f"COLOR_{step['code']}")}
+
+
+class Pipeline:
+    def __init__(self, name: str, steps: list):
+        self.name = name
+        self.steps = [validate_step(step) for step in steps]
+
+    def run(self, frame: np.ndarray) -> np.ndarray:
+        original = frame
+        # Regions taken from the input frame, only drawn when debugging
+        regions = []
+        i = 0
+        while i < len(self.steps):
+            step = self.steps[i]
+            following = self.steps[i + 1] if i + 1 < len(self.steps) else None
+            if step["op"] == "resize" and following is not None and following["op"] == "crop":
+                frame, region = resize_crop(frame, step["size"], following["box"])
+                if i == 0:
+                    regions.append(region)
+                i += 2
+                continue
+
+            if step["op"] == "crop":
+                x1, y1, x2, y2 = step["box"]
+                frame = frame[y1:y2, x1:x2]
+                if i == 0:
+                    regions.append(step["box"])
+            elif step["op"] == "resize":
+                frame = cv2.resize(frame, step["size"])
+            else:
+                frame = cv2.cvtColor(frame, step["code"])
+            i += 1
+
+        if config.PREPROCESS_DEBUG_DIR:
+            self.save_debug(original, regions)
+        return frame
+
+    def save_debug(self, frame, regions):
+        # Drawn on a copy so the frame handed to the model is never touched
+        annotated = frame.copy()
+        for x1, y1, x2, y2 in regions:
+            cv2.rectangle(annotated, (x1, y1), (x2, y2), (255, 255, 0), 2)
+        os.makedirs(config.PREPROCESS_DEBUG_DIR, exist_ok=True)
+        cv2.imwrite(os.path.join(config.PREPROCESS_DEBUG_DIR, f"{self.name}.jpg"), annotated)
+
+
+def resize_crop(frame: np.ndarray, size, box):
+    """Resize then crop, done as a crop of the input followed by resizing only that region.
+
+    Returns the result and the region in the input's pixels.
+    """
+    h, w = frame.shape[:2]
+    sx, sy = w / size[0], h / size[1]
+    x1, y1, x2, y2 = box
+    region = (round(x1 * sx), round(y1 * sy), round(x2 * sx), round(y2 * sy))
+    view = frame[region[1] : region[3], region[0] : region[2]]
+    return cv2.resize(view, (x2 - x1, y2 - y1)), region
+
+
+_pipelines = {}
+_pipelines_lock = Lock()
+_overrides = None
+
+
+def load_overrides() -> dict:
+    if not config.PREPROCESS_CONFIG or not os.path.exists(config.PREPROCESS_CONFIG):
+        return {}
+    with open(config.PREPROCESS_CONFIG) as f:
+        overrides = json.load(f)
+    logger.info(f"Loaded preprocessing for {sorted(overrides)} from {config.PREPROCESS_CONFIG}")
+    return overrides
+
+
+def get_pipeline(name: str) -> Pipeline:
+    """Return the preprocessing pipeline of an action (empty if it has none)"""
+    global _overrides
+    with _pipelines_lock:
+        if name not in _pipelines:
+            if _overrides is None:
+                _overrides = load_overrides()
+            _pipelines[name] = Pipeline(name, _overrides.get(name, DEFAULT_PIPELINES.get(name, [])))
+        return _pipelines[name]
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable
+
+import metrics
+from errors import Rejected
+
+DEFAULT_SESSION = "default"
+SESSION_HEADER = "X-Session-Id"
+
+
+def request_session(request) -> str:
+    """Session id of a request: the X-Session-Id header or the `session` query parameter"""
+    return request.headers.get(SESSION_HEADER) or request.args.get("session") or DEFAULT_SESSION
+
+
+class SessionStore:
+    """Per-session state for one action, e.g. one game table per session.
+
+    State is created by `factory` on first use. Sessions idle for more than
+    `ttl` seconds are dropped. A new session beyond `max_sessions` is refused
+    with a 429 rather than evicting a live one, so abandoned clients cannot
+    grow it without bound and a busy server never loses a game in progress.
+    """
+
+    def __init__(self, name: str, factory: Callable, ttl: float, max_sessions: int):
+        self.name = name
+        self.factory = factory
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+        metrics.register_gauge("sessions", lambda: [({"action": self.name}, len(self))])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, session: str):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if session in self._sessions:
+                state, _ = self._sessions.pop(session)
+            elif len(self._sessions) >= self.max_sessions:
+                metrics.inc("sessions_refused", action=self.name)
+                raise Rejected(
+                    f"Already serving {self.max_sessions} '{self.name}' sessions, "
+                    f"retry after one has been idle for {self.ttl:.0f}s",
+                    status=429,
+                )
+            else:
+                state = self.factory()
+                metrics.inc("sessions_created", action=self.name)
+            self._sessions[session] = (state, now)
+            return state
+
+    def drop(self, session: str):
+        with self._lock:
+            self._sessions.pop(session, None)
+
+    def _expire(self, now: float):
+        # Least recently used first, so stop at the first live session
+        while self._sessions:
+            session, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.ttl:
+                break
+            del self._sessions[session]
+            metrics.inc("sessions_expired", action=self.name)
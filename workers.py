@@ -0,0 +1,194 @@
+import atexit
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from threading import Lock
+
+import numpy as np
+
+from logger import logger
+import config
+import metrics
+
+
+class FrameBuffer:
+    """Shared-memory block the parent writes decoded frames into.
+
+    The block only grows: it is replaced by a larger one when a request does
+    not fit, so steady-state requests reuse the same pages.
+    """
+
+    def __init__(self):
+        self.shm = None
+
+    def write(self, frames):
+        arrays = [np.ascontiguousarray(np.asarray(frame, dtype=np.uint8)) for frame in frames]
+        total = sum(a.nbytes for a in arrays)
+        if self.shm is None or self.shm.size < total:
+            self.close()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(total, 1))
+
+        layout = []
+        offset = 0
+        for a in arrays:
+            view = np.ndarray(a.shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+            view[...] = a
+            layout.append((offset, a.shape))
+            offset += a.nbytes
+        return self.shm.name, layout
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class ModelWorker:
+    """Runs every action of one models/ module in a separate process"""
+
+    def __init__(self, module: str):
+        self.module = module
+        self.process = None
+        self.conn = None
+        self.buffer = FrameBuffer()
+        self._lock = Lock()
+
+    def start(self):
+        ctx = mp.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=worker_main,
+            args=(child_conn, self.module),
+            name=f"worker-{self.module}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        logger.info(f"Started worker process {self.process.pid} for {self.module}")
+
+    def terminate(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(timeout=5)
+            self.conn.close()
+        self.process = None
+
+    def call(self, action: str, frames, sessions: list, batch: bool):
+        timeout = config.INFERENCE_TIMEOUT
+        # Requests queued behind a hung one give up too, instead of waiting forever
+        if not self._lock.acquire(timeout=timeout):
+            raise TimeoutError(f"Worker for {self.module} is busy for more than {timeout}s")
+        try:
+            if self.process is None or not self.process.is_alive():
+                self.start()
+
+            shm_name, layout = self.buffer.write(frames)
+            try:
+                self.conn.send((action, shm_name, layout, sessions, batch))
+                answered = self.conn.poll(timeout)
+                if answered:
+                    status, result, samples = self.conn.recv()
+            except (EOFError, OSError) as e:
+                # The worker died mid-request; the next call starts a fresh one
+                self.process = None
+                raise RuntimeError(f"Worker for {self.module} exited: {e}")
+
+            if not answered:
+                # A hung worker would block every action of its module
+                logger.error(f"Worker for {self.module} did not answer '{action}' within {timeout}s, restarting it")
+                self.terminate()
+                self.start()
+                raise TimeoutError(f"Worker for {self.module} did not answer within {timeout}s")
+        finally:
+            self._lock.release()
+
+        # Stage timings recorded inside the worker
+        metrics.merge(samples)
+        if status == "rejected":
+            from models.registry import Rejected
+
+            raise Rejected(*result)
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.conn.send(None)
+            self.process.join(timeout=5)
+        self.buffer.close()
+
+
+def worker_main(conn, module: str):
+    from models import MODELS
+    from models.registry import Rejected, preload_models
+
+    preload_models(
+        name for name in config.PRELOAD_MODELS
+        if name in MODELS and MODELS[name].handler.__module__ == module
+    )
+    metrics.start_buffering()
+
+    shm = None
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+
+        action, shm_name, layout, sessions, batch = message
+        if shm is None or shm.name != shm_name:
+            if shm is not None:
+                shm.close()
+            # The parent owns the block and unlinks it; attaching only maps it
+            shm = shared_memory.SharedMemory(name=shm_name)
+
+        # Views into shared memory, no copy; handlers must not keep them
+        frames = [
+            np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+            for offset, shape in layout
+        ]
+        try:
+            spec = MODELS[action]
+            if batch:
+                result = spec.run_batch(frames, sessions)
+            else:
+                result = spec.run(frames[0], sessions[0])
+            conn.send(("ok", result, metrics.drain()))
+        except Rejected as e:
+            conn.send(("rejected", (str(e), e.status), metrics.drain()))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}", metrics.drain()))
+        finally:
+            del frames
+
+    if shm is not None:
+        shm.close()
+
+
+_workers = {}
+_workers_lock = Lock()
+
+
+def get_worker(name: str):
+    """Return the worker process serving an action, or None if it runs in-process"""
+    from models import MODELS
+
+    # Actions defined in the same module share state (e.g. rubik and rubikReset),
+    # so listing one of them moves the whole module into the worker
+    module = MODELS[name].handler.__module__
+    if not any(
+        action in MODELS and MODELS[action].handler.__module__ == module
+        for action in config.WORKER_ACTIONS
+    ):
+        return None
+
+    with _workers_lock:
+        if module not in _workers:
+            _workers[module] = ModelWorker(module)
+        return _workers[module]
+
+
+@atexit.register
+def stop_workers():
+    for worker in _workers.values():
+        worker.stop()